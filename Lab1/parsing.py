@@ -1,46 +1,636 @@
+import argparse
+import asyncio
+import hashlib
 import os
+import tempfile
+import time
+from urllib.parse import urljoin
 
+import aiohttp
 from bs4 import BeautifulSoup
-import requests
+
+from duplicates import DuplicateIndex
+from fetch import Fetcher, LatencyHistogram, create_timeout
+from manifest import Manifest
 
 HEADERS = {"User-Agent": "Mozilla/5.0"}
+SEARCH_URL = "https://yandex.ru/images/search?p={page}&text={key}"
+CONCURRENCY = 16
+HOST_RATE = 10.0
+WORKERS = 16
+QUEUE_SIZE = 64
+TEMP_SUFFIX = ".part"
+CHUNK_SIZE = 64 * 1024
+JPEG_MAGIC = b"\xff\xd8\xff"
+PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+MAGIC_LENGTH = len(PNG_MAGIC)
+PROGRESS_INTERVAL = 5.0
+
+
+class Downloader:
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int = CONCURRENCY,
+                 rate: float = HOST_RATE):
+        """
+        Инициализация
+        :param session: Сессия с общим пулом соединений
+        :param concurrency: Максимальное количество одновременных запросов
+        :param rate: Максимальное количество запросов в секунду к одному хосту
+        """
+        self.fetcher = Fetcher(session, concurrency, rate, HEADERS)
+
+    async def get(self, url: str) -> bytes:
+        """
+        Получение содержимого по адресу
+        :param url: Адрес запроса
+        :return: Тело ответа
+        """
+        return await self.fetcher.fetch(url, aiohttp.ClientResponse.read)
 
+    async def download(self, url: str, file_path: str) -> tuple[int, str]:
+        """
+        Потоковая загрузка изображения в файл с проверкой содержимого
+        :param url: Ссылка на изображение
+        :param file_path: Путь к файлу
+        :return: Размер и SHA-256 содержимого
+        """
+        async def write(response: aiohttp.ClientResponse) -> tuple[int, str]:
+            return await write_response(url, response, file_path)
 
-def download_images(path: str, key: str, page: int, count: int = 1000) -> int:
+        return await self.fetcher.fetch(url, write)
+
+
+async def write_response(url: str, response: aiohttp.ClientResponse,
+                         file_path: str) -> tuple[int, str]:
     """
-    Парсинг изображений
+    Потоковая запись ответа в файл с проверкой сигнатуры и длины
+    :param url: Ссылка на изображение
+    :param response: Ответ сервера
+    :param file_path: Путь к файлу
+    :return: Размер и SHA-256 содержимого
+    """
+    digest = hashlib.sha256()
+    header = b""
+    size = 0
+    expected = response.content_length
+    if response.headers.get("Content-Encoding"):
+        expected = None
+    with open(file_path, "wb") as f:
+        async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+            if len(header) < MAGIC_LENGTH:
+                header += chunk[:MAGIC_LENGTH - len(header)]
+                if len(header) == MAGIC_LENGTH and not is_image(header):
+                    raise ValueError(f"Not an image: {url}")
+            f.write(chunk)
+            digest.update(chunk)
+            size += len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    if not is_image(header):
+        raise ValueError(f"Not an image: {url}")
+    if expected is not None and size != expected:
+        raise ValueError(f"Truncated image: {url} ({size} of {expected} bytes)")
+    return size, digest.hexdigest()
+
+
+def is_image(header: bytes) -> bool:
+    """
+    Проверка сигнатуры JPEG или PNG
+    :param header: Первые байты файла
+    :return: True, если сигнатура известна
+    """
+    return header.startswith(JPEG_MAGIC) or header.startswith(PNG_MAGIC)
+
+
+def create_session(concurrency: int = CONCURRENCY) -> aiohttp.ClientSession:
+    """
+    Создание сессии с общим пулом соединений
+    :param concurrency: Размер пула соединений
+    :return: Сессия
+    """
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency),
+                                 timeout=create_timeout())
+
+
+def get_image_urls(html: str, page_url: str) -> list[str]:
+    """
+    Получение ссылок на изображения со страницы поиска
+    :param html: Код страницы
+    :param page_url: Адрес страницы
+    :return: Список ссылок на изображения
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    urls = []
+    for image in soup.find_all('img', 'ContentImage-Image_clickable'):
+        image_url = image.get("src")
+        if image_url and not image_url.startswith("data:"):
+            urls.append(urljoin(page_url, image_url))
+    return urls
+
+
+class StageCounter:
+    def __init__(self, name: str):
+        """
+        Инициализация
+        :param name: Название стадии
+        """
+        self.name = name
+        self.items = 0
+        self.bytes = 0
+        self.failures = 0
+        self.start = time.monotonic()
+
+    def add(self, size: int):
+        """
+        Учёт обработанного элемента
+        :param size: Размер элемента в байтах
+        :return:
+        """
+        self.items += 1
+        self.bytes += size
+
+    def items_per_second(self) -> float:
+        """
+        Пропускная способность в элементах в секунду
+        """
+        return self.items / max(time.monotonic() - self.start, 1e-9)
+
+    def bytes_per_second(self) -> float:
+        """
+        Пропускная способность в байтах в секунду
+        """
+        return self.bytes / max(time.monotonic() - self.start, 1e-9)
+
+    def __str__(self):
+        return (f"{self.name}: {self.items} ({self.items_per_second():.1f}/s, "
+                f"{self.bytes_per_second() / 1024:.1f} KiB/s, {self.failures} failed)")
+
+
+class PipelineStats:
+    def __init__(self):
+        """
+        Инициализация счётчиков стадий конвейера
+        """
+        self.pages = StageCounter("pages")
+        self.images = StageCounter("images")
+
+    def __str__(self):
+        return f"{self.pages}; {self.images}"
+
+
+class CollectState:
+    def __init__(self, key: str, index: int, remaining: int, manifest: Manifest = None,
+                 duplicates: DuplicateIndex = None, start_page: int = 1):
+        """
+        Инициализация состояния сбора одного класса
+        :param key: Класс изображения
+        :param index: Номер следующего сохраняемого изображения
+        :param remaining: Сколько изображений осталось сохранить
+        :param manifest: Манифест скачанных изображений
+        :param duplicates: Индекс почти-дубликатов
+        :param start_page: Страница старта
+        """
+        self.key = key
+        self.index = index
+        self.remaining = remaining
+        self.manifest = manifest
+        self.duplicates = duplicates
+        self.page = None
+        self.pending = {}
+        self.enqueued = set()
+        self.completed = set()
+        self.next_page = start_page
+        self.done = asyncio.Event()
+
+    def start_item(self, page: int):
+        """
+        Учёт ссылки, поставленной в очередь
+        :param page: Страница поиска
+        :return:
+        """
+        self.pending[page] = self.pending.get(page, 0) + 1
+
+    def finish_item(self, page: int):
+        """
+        Учёт обработанной ссылки
+        :param page: Страница поиска
+        :return:
+        """
+        self.pending[page] -= 1
+        self.check_page(page)
+
+    def finish_page(self, page: int):
+        """
+        Учёт страницы, все ссылки которой поставлены в очередь
+        :param page: Страница поиска
+        :return:
+        """
+        self.enqueued.add(page)
+        self.check_page(page)
+
+    def check_page(self, page: int):
+        """
+        Учёт страницы, все изображения которой обработаны. Страницы завершаются
+        не по порядку, поэтому в манифест записывается последняя страница,
+        до которой включительно завершены все страницы
+        :param page: Страница поиска
+        :return:
+        """
+        if page in self.enqueued and not self.pending.get(page):
+            self.enqueued.discard(page)
+            self.pending.pop(page, None)
+            self.completed.add(page)
+            advanced = False
+            while self.next_page in self.completed:
+                self.completed.discard(self.next_page)
+                self.next_page += 1
+                advanced = True
+            if advanced and self.manifest is not None:
+                self.manifest.complete_page(self.key, self.next_page - 1)
+
+    def next_file(self, path: str) -> str:
+        """
+        Выдача имени для следующего сохраняемого изображения
+        :param path: Путь к папке с изображениями
+        :return: Путь к файлу
+        """
+        file_path = os.path.join(f"{path}/{str(self.index).zfill(4)}.jpg")
+        self.index += 1
+        return file_path
+
+    def saved(self, page: int):
+        """
+        Учёт сохранённого изображения
+        :param page: Страница поиска
+        :return:
+        """
+        self.remaining -= 1
+        if self.remaining <= 0:
+            self.page = page
+            self.done.set()
+
+
+def scan_images(path: str) -> tuple[int, int]:
+    """
+    Подсчёт сохранённых изображений и удаление незавершённых временных файлов
+    :param path: Путь к папке с изображениями
+    :return: Количество изображений и номер следующего изображения
+    """
+    count = 0
+    index = 0
+    for name in os.listdir(path):
+        if name.endswith(TEMP_SUFFIX):
+            os.remove(os.path.join(path, name))
+            continue
+        count += 1
+        stem = os.path.splitext(name)[0]
+        if stem.isdigit():
+            index = max(index, int(stem) + 1)
+    return count, max(index, count)
+
+
+async def produce_pages(downloader: Downloader, queue: asyncio.Queue, page: int,
+                        search_url: str, stats: PipelineStats, state: CollectState):
+    """
+    Загрузка и разбор страниц поиска с передачей новых ссылок в очередь
+    :param downloader: Загрузчик
+    :param queue: Очередь пар (страница, ссылка)
+    :param page: Страница старта
+    :param search_url: Шаблон адреса страницы поиска
+    :param stats: Счётчики стадий
+    :param state: Состояние сбора
+    :return:
+    """
+    while not state.done.is_set():
+        url = search_url.format(page=page, key=state.key)
+        try:
+            html = await downloader.get(url)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            stats.pages.failures += 1
+            raise
+        image_urls = await asyncio.to_thread(get_image_urls, html.decode(errors="replace"), url)
+        stats.pages.add(len(html))
+        for image_url in image_urls:
+            if state.manifest is not None and state.manifest.has_url(image_url):
+                continue
+            state.start_item(page)
+            await queue.put((page, image_url))
+        state.finish_page(page)
+        page += 1
+
+
+async def consume_images(downloader: Downloader, queue: asyncio.Queue, path: str,
+                         stats: PipelineStats, state: CollectState):
+    """
+    Загрузка изображений из очереди
+    :param downloader: Загрузчик
+    :param queue: Очередь пар (страница, ссылка)
+    :param path: Путь к папке с изображениями
+    :param stats: Счётчики стадий
+    :param state: Состояние сбора
+    :return:
+    """
+    while not state.done.is_set():
+        page, image_url = await queue.get()
+        descriptor, temp_path = tempfile.mkstemp(TEMP_SUFFIX, dir=path)
+        os.close(descriptor)
+        try:
+            size, digest = await downloader.download(image_url, temp_path)
+            stats.images.add(size)
+            if state.done.is_set():
+                return
+            await save_image(path, page, image_url, temp_path, digest, state)
+        except (ValueError, aiohttp.ClientError, asyncio.TimeoutError):
+            stats.images.failures += 1
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        state.finish_item(page)
+
+
+async def save_image(path: str, page: int, image_url: str, temp_path: str, digest: str,
+                     state: CollectState):
+    """
+    Перенос скачанного изображения в датасет, если оно не является дубликатом
+    :param path: Путь к папке с изображениями
+    :param page: Страница поиска
+    :param image_url: Ссылка на изображение
+    :param temp_path: Путь к временному файлу с изображением
+    :param digest: SHA-256 содержимого
+    :param state: Состояние сбора
+    :return:
+    """
+    if state.manifest is not None and state.manifest.find_hash(digest):
+        state.manifest.add(image_url, digest, None, state.key, page)
+        return
+    value = None
+    if state.duplicates is not None:
+        try:
+            value = await asyncio.to_thread(state.duplicates.hash_file, temp_path)
+        except OSError:
+            value = None
+        if state.done.is_set():
+            return
+        if value is not None and state.duplicates.find(value) is not None:
+            if state.manifest is not None:
+                state.manifest.add(image_url, digest, None, state.key, page)
+            return
+    file_path = state.next_file(path)
+    os.replace(temp_path, file_path)
+    if value is not None:
+        state.duplicates.add(value, file_path)
+    if state.manifest is not None:
+        state.manifest.add(image_url, digest, file_path, state.key, page)
+    state.saved(page)
+
+
+async def download_images_async(downloader: Downloader, path: str, key: str, page: int,
+                                count: int = 1000, search_url: str = SEARCH_URL,
+                                workers: int = WORKERS, queue_size: int = QUEUE_SIZE,
+                                stats: PipelineStats = None, manifest: Manifest = None,
+                                duplicates: DuplicateIndex = None) -> int:
+    """
+    Асинхронный парсинг изображений конвейером: разбор страниц и загрузка изображений
+    выполняются параллельно
+    :param downloader: Загрузчик
     :param path: Путь к папке с изображениями
     :param key: Класс изображения
     :param page: Страница старта
     :param count: Количество скачиваемых изображений
+    :param search_url: Шаблон адреса страницы поиска
+    :param workers: Количество загрузчиков изображений
+    :param queue_size: Глубина очереди ссылок
+    :param stats: Счётчики стадий
+    :param manifest: Манифест скачанных изображений, позволяет пропускать известные
+    ссылки и продолжать с последней обработанной страницы
+    :param duplicates: Индекс почти-дубликатов, совпадающие с ним изображения не сохраняются
     :return: Страница окончания
     """
-    index = len(os.listdir(path))
-    if index >= count:
+    saved, index = scan_images(path)
+    if saved >= count:
         return page
+    if manifest is not None:
+        last_page = manifest.last_page(key)
+        if last_page is not None:
+            page = max(page, last_page + 1)
+    if stats is None:
+        stats = PipelineStats()
+    state = CollectState(key, index, count - saved, manifest, duplicates, page)
+    queue = asyncio.Queue(queue_size)
+    tasks = [asyncio.create_task(produce_pages(downloader, queue, page, search_url, stats, state))]
+    tasks += [asyncio.create_task(consume_images(downloader, queue, path, stats, state))
+              for _ in range(workers)]
+    done_task = asyncio.create_task(state.done.wait())
+    try:
+        finished, _ = await asyncio.wait([done_task, *tasks], return_when=asyncio.FIRST_COMPLETED)
+        for task in finished:
+            task.result()
+    finally:
+        for task in [done_task, *tasks]:
+            task.cancel()
+    return state.page
+
+
+async def run_download(path: str, key: str, page: int, count: int = 1000,
+                       concurrency: int = CONCURRENCY, rate: float = HOST_RATE,
+                       search_url: str = SEARCH_URL, workers: int = WORKERS,
+                       queue_size: int = QUEUE_SIZE, stats: PipelineStats = None,
+                       manifest: Manifest = None, duplicates: DuplicateIndex = None) -> int:
+    """
+    Запуск асинхронного парсинга в отдельной сессии
+    :param path: Путь к папке с изображениями
+    :param key: Класс изображения
+    :param page: Страница старта
+    :param count: Количество скачиваемых изображений
+    :param concurrency: Максимальное количество одновременных запросов
+    :param rate: Максимальное количество запросов в секунду к одному хосту
+    :param search_url: Шаблон адреса страницы поиска
+    :param workers: Количество загрузчиков изображений
+    :param queue_size: Глубина очереди ссылок
+    :param stats: Счётчики стадий
+    :param manifest: Манифест скачанных изображений
+    :param duplicates: Индекс почти-дубликатов
+    :return: Страница окончания
+    """
+    async with create_session(concurrency) as session:
+        downloader = Downloader(session, concurrency, rate)
+        return await download_images_async(downloader, path, key, page, count, search_url,
+                                           workers, queue_size, stats, manifest, duplicates)
+
+
+def download_images(path: str, key: str, page: int, count: int = 1000,
+                    concurrency: int = CONCURRENCY, rate: float = HOST_RATE,
+                    search_url: str = SEARCH_URL, workers: int = WORKERS,
+                    queue_size: int = QUEUE_SIZE, stats: PipelineStats = None,
+                    manifest: str = None, duplicates: DuplicateIndex = None) -> int:
+    """
+    Парсинг изображений
+    :param path: Путь к папке с изображениями
+    :param key: Класс изображения
+    :param page: Страница старта
+    :param count: Количество скачиваемых изображений
+    :param concurrency: Максимальное количество одновременных запросов
+    :param rate: Максимальное количество запросов в секунду к одному хосту
+    :param search_url: Шаблон адреса страницы поиска
+    :param workers: Количество загрузчиков изображений
+    :param queue_size: Глубина очереди ссылок
+    :param stats: Счётчики стадий
+    :param manifest: Путь к файлу манифеста скачанных изображений
+    :param duplicates: Индекс почти-дубликатов
+    :return: Страница окончания
+    """
+    if manifest is None:
+        return asyncio.run(run_download(path, key, page, count, concurrency, rate, search_url,
+                                        workers, queue_size, stats, None, duplicates))
+    with Manifest(manifest) as opened:
+        return asyncio.run(run_download(path, key, page, count, concurrency, rate, search_url,
+                                        workers, queue_size, stats, opened, duplicates))
+
+
+def format_progress(stats: list[PipelineStats], start: float) -> str:
+    """
+    Сводная строка прогресса по всем классам
+    :param stats: Счётчики стадий каждого класса
+    :param start: Время начала сбора
+    :return: Строка прогресса
+    """
+    elapsed = max(time.monotonic() - start, 1e-9)
+    images = sum(item.images.items for item in stats)
+    size = sum(item.images.bytes for item in stats)
+    failures = sum(item.images.failures + item.pages.failures for item in stats)
+    return (f"images: {images} ({images / elapsed:.1f}/s), "
+            f"{size / elapsed / 1024:.1f} KiB/s, failures: {failures}")
+
+
+async def report_progress(stats: list[PipelineStats], interval: float):
+    """
+    Периодический вывод сводного прогресса
+    :param stats: Счётчики стадий каждого класса
+    :param interval: Период вывода в секундах
+    :return:
+    """
+    start = time.monotonic()
     while True:
-        url = f'https://yandex.ru/images/search?p={page}&text={key}'
-        response = requests.get(url, headers=HEADERS)
-        soup = BeautifulSoup(response.text, 'lxml')
-        images = soup.find_all('img', 'ContentImage-Image_clickable')
-        for image in images:
-            if index >= count:
-                return page
-            image_url = image.get("src")
-            if image_url and not image_url.startswith("data:"):
-                picture = requests.get(f"https:{image_url}", HEADERS)
-
-                with open(os.path.join(f"{path}/{str(index).zfill(4)}.jpg"), "wb") as f:
-                    f.write(picture.content)
-
-                index += 1
-        page += 1
+        await asyncio.sleep(interval)
+        print(format_progress(stats, start), flush=True)
+
+
+async def collect_async(dataset_dir: str, queries: dict[str, str], page: int = 1,
+                        count: int = 1000, concurrency: int = CONCURRENCY,
+                        rate: float = HOST_RATE, workers: int = WORKERS,
+                        queue_size: int = QUEUE_SIZE, manifest: Manifest = None,
+                        duplicates: DuplicateIndex = None,
+                        interval: float = PROGRESS_INTERVAL,
+                        stats: dict[str, PipelineStats] = None,
+                        latency: dict[str, LatencyHistogram] = None
+                        ) -> dict[str, int | Exception]:
+    """
+    Одновременный сбор нескольких классов с общим пулом соединений
+    :param dataset_dir: Папка датасета
+    :param queries: Словарь класс -> поисковый запрос
+    :param page: Страница старта
+    :param count: Количество скачиваемых изображений каждого класса
+    :param concurrency: Общее максимальное количество одновременных запросов
+    :param rate: Максимальное количество запросов в секунду к одному хосту
+    :param workers: Количество загрузчиков изображений каждого класса
+    :param queue_size: Глубина очереди ссылок каждого класса
+    :param manifest: Манифест скачанных изображений
+    :param duplicates: Индекс почти-дубликатов
+    :param interval: Период вывода прогресса в секундах
+    :param stats: Словарь, в который записываются счётчики стадий каждого класса
+    :param latency: Словарь, в который записываются гистограммы задержек по хостам
+    :return: Словарь класс -> страница окончания или ошибка, прервавшая сбор класса.
+    Ошибка одного класса не останавливает сбор остальных
+    """
+    if stats is None:
+        stats = {}
+    for class_name in queries:
+        stats.setdefault(class_name, PipelineStats())
+    reporter = asyncio.create_task(report_progress(list(stats.values()), interval))
+    try:
+        async with create_session(concurrency) as session:
+            downloader = Downloader(session, concurrency, rate)
+            results = await asyncio.gather(*(
+                download_images_async(downloader, os.path.join(dataset_dir, class_name), query,
+                                      page, count, SEARCH_URL, workers, queue_size,
+                                      stats[class_name], manifest, duplicates)
+                for class_name, query in queries.items()), return_exceptions=True)
+            if latency is not None:
+                latency.update(downloader.fetcher.latency)
+    finally:
+        reporter.cancel()
+    for class_name, result in zip(queries, results):
+        if isinstance(result, Exception) and not isinstance(
+                result, (aiohttp.ClientError, asyncio.TimeoutError)):
+            stats[class_name].pages.failures += 1
+    return dict(zip(queries, results))
+
+
+def parse_queries(values: list[str]) -> dict[str, str]:
+    """
+    Разбор аргументов вида класс или класс=запрос
+    :param values: Аргументы командной строки
+    :return: Словарь класс -> поисковый запрос
+    """
+    queries = {}
+    for value in values:
+        class_name, _, query = value.partition("=")
+        queries[class_name] = query or class_name
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сбор датасета изображений")
+    parser.add_argument("classes", nargs="+", help="Классы в виде class или class=query")
+    parser.add_argument("--dataset", default="dataset", help="Папка датасета")
+    parser.add_argument("--page", type=int, default=1, help="Страница старта")
+    parser.add_argument("--count", type=int, default=1000, help="Изображений на класс")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="Общее количество одновременных запросов")
+    parser.add_argument("--rate", type=float, default=HOST_RATE,
+                        help="Запросов в секунду к одному хосту")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Загрузчиков изображений на класс")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Глубина очереди ссылок")
+    parser.add_argument("--manifest", default=None, help="Путь к файлу манифеста")
+    parser.add_argument("--radius", type=int, default=None,
+                        help="Радиус поиска почти-дубликатов, по умолчанию не ищутся")
+    parser.add_argument("--interval", type=float, default=PROGRESS_INTERVAL,
+                        help="Период вывода прогресса в секундах")
+    args = parser.parse_args()
+
+    queries = parse_queries(args.classes)
+    duplicates = None
+    if args.radius is not None:
+        duplicates = DuplicateIndex(args.radius)
+    for class_name in queries:
+        class_path = os.path.join(args.dataset, class_name)
+        if not os.path.exists(class_path):
+            os.makedirs(class_path)
+        if duplicates is not None:
+            duplicates.add_directory(class_path)
+
+    manifest = Manifest(args.manifest) if args.manifest else None
+    stats = {}
+    latency = {}
+    start = time.monotonic()
+    try:
+        results = asyncio.run(collect_async(args.dataset, queries, args.page, args.count,
+                                            args.concurrency, args.rate, args.workers,
+                                            args.queue_size, manifest, duplicates,
+                                            args.interval, stats, latency))
+    finally:
+        if manifest is not None:
+            manifest.close()
+    print(format_progress(list(stats.values()), start))
+    for host, histogram in latency.items():
+        print(f"{host}: {histogram}")
+    for class_name, result in results.items():
+        if isinstance(result, Exception):
+            print(f"{class_name}: failed: {result!r}")
+        else:
+            print(f"{class_name}: {result}")
 
 
 if __name__ == "__main__":
-    if not os.path.exists("dataset/cat"):
-        os.makedirs("dataset/cat")
-    if not os.path.exists("dataset/dog"):
-        os.makedirs("dataset/dog")
-    print(download_images("dataset/cat", 'cat', 1, 1000))
-    print(download_images("dataset/dog", 'dog', 1, 1000))
+    main()
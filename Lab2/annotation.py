@@ -1,5 +1,16 @@
 import os
 import csv
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+WRITE_BUFFER = 1024 * 1024
+STATE_SUFFIX = '.state'
+SCAN_WORKERS = 8
+SCAN_CHUNK = 1024
+SCAN_QUEUE = 64
+PROGRESS_STEP = 1000
 
 
 def get_paths(data_dir: str) -> list[str]:
@@ -27,23 +38,219 @@ def get_abs_paths(data_dir: str) -> list[str]:
     return paths
 
 
-def create_annotation(dataset_dir: str, classes: list[str], save_path: str):
+def scan_dir(data_dir: str) -> Iterator[tuple[str, str, os.DirEntry]]:
+    """
+    Обход папки с изображениями за один проход
+    :param data_dir: Путь к папке с изображениями
+    :return: Тройки (абсолютный путь, относительный путь, запись папки) для каждого файла
+    """
+    abs_prefix = os.path.join(os.path.abspath(data_dir), '')
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield abs_prefix + entry.name, entry.path, entry
+
+
+def scan_worker(data_dir: str, chunks: queue.Queue, stop: threading.Event):
+    """
+    Обход папки в фоновом потоке с передачей записей порциями
+    :param data_dir: Путь к папке с изображениями
+    :param chunks: Очередь порций, в конце передаётся None или исключение
+    :param stop: Событие остановки обхода
+    :return:
+    """
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        chunk = []
+        for row in scan_dir(data_dir):
+            chunk.append(row)
+            if len(chunk) >= SCAN_CHUNK:
+                if not put(chunk):
+                    return
+                chunk = []
+        if chunk and not put(chunk):
+            return
+        put(None)
+    except OSError as exc:
+        put(exc)
+
+
+def scan_dirs(data_dirs: list[str], workers: int = SCAN_WORKERS,
+              queue_size: int = SCAN_QUEUE) -> Iterator[tuple[int, str, str, os.DirEntry]]:
+    """
+    Параллельный обход нескольких папок пулом потоков. Записи выдаются потоком
+    в порядке папок, пока следующие папки читаются в фоне
+    :param data_dirs: Пути к папкам с изображениями
+    :param workers: Количество потоков
+    :param queue_size: Количество порций, буферизуемых для каждой папки
+    :return: Четвёрки (номер папки, абсолютный путь, относительный путь, запись папки)
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(queue_size) for _ in data_dirs]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for data_dir, chunks in zip(data_dirs, queues):
+            executor.submit(scan_worker, data_dir, chunks, stop)
+        try:
+            for index, chunks in enumerate(queues):
+                while (chunk := chunks.get()) is not None:
+                    if isinstance(chunk, Exception):
+                        raise chunk
+                    for abs_path, path, entry in chunk:
+                        yield index, abs_path, path, entry
+        finally:
+            stop.set()
+
+
+def get_state_path(save_path: str) -> str:
+    """
+    Путь к файлу состояния инкрементальной аннотации
+    :param save_path: Путь к аннотации
+    :return: Путь к файлу состояния
+    """
+    return save_path + STATE_SUFFIX
+
+
+def get_signature(entry: os.DirEntry) -> tuple[int, int, int]:
+    """
+    Признаки изменения файла
+    :param entry: Запись папки
+    :return: Время изменения в наносекундах, размер и номер inode
+    """
+    stat = entry.stat()
+    return stat.st_mtime_ns, stat.st_size, entry.inode()
+
+
+def read_state(state_path: str) -> dict[str, tuple[int, int, int]]:
+    """
+    Чтение файла состояния
+    :param state_path: Путь к файлу состояния
+    :return: Словарь абсолютный путь -> признаки изменения файла
+    """
+    state = {}
+    with open(state_path, 'r', newline='', encoding='utf-8') as state_file:
+        for abs_path, mtime, size, inode in csv.reader(state_file, delimiter='\t'):
+            state[abs_path] = (int(mtime), int(size), int(inode))
+    return state
+
+
+def replace_file(path: str, rows: Iterable[Iterable]):
+    """
+    Атомарная перезапись файла строками TSV
+    :param path: Путь к файлу
+    :param rows: Строки
+    :return:
+    """
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', buffering=WRITE_BUFFER, encoding='utf-8') as csv_file:
+            csv.writer(csv_file, delimiter='\t', lineterminator='\n').writerows(rows)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+
+
+def report_rows(rows: Iterable, progress: Callable[[int, int | None], None]) -> Iterator:
+    """
+    Передача строк с периодическим вызовом функции прогресса
+    :param rows: Строки
+    :param progress: Функция, вызываемая с числом обработанных строк и общим числом строк,
+    известным только в конце
+    :return: Те же строки
+    """
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % PROGRESS_STEP == 0:
+            progress(count, None)
+    progress(count, count)
+
+
+def write_annotation(rows: Iterable[tuple[str, str, str, os.DirEntry]], save_path: str,
+                     incremental: bool = False,
+                     progress: Callable[[int, int | None], None] = None) -> bool:
+    """
+    Запись аннотации. В инкрементальном режиме текущие файлы сравниваются с сохранённым
+    состоянием (время изменения, размер, inode): новые строки дописываются, строки удалённых
+    файлов убираются, а если ничего не изменилось, аннотация не трогается
+    :param rows: Строки (абсолютный путь, относительный путь, класс, запись папки)
+    :param save_path: Путь к аннотации
+    :param incremental: Инкрементальный режим
+    :param progress: Функция, вызываемая с числом обработанных строк и общим числом строк
+    :return: True, если аннотация была изменена
+    """
+    state_path = get_state_path(save_path)
+    skip = {os.path.abspath(save_path), os.path.abspath(state_path)}
+    rows = (row for row in rows if row[0] not in skip)
+    if progress is not None:
+        rows = report_rows(rows, progress)
+    if not incremental or not os.path.exists(save_path) or not os.path.exists(state_path):
+        state = {}
+
+        def get_rows() -> Iterator[tuple[str, str, str]]:
+            for abs_path, path, class_name, entry in rows:
+                if incremental:
+                    state[abs_path] = get_signature(entry)
+                yield abs_path, path, class_name
+
+        replace_file(save_path, get_rows())
+        if incremental:
+            replace_file(state_path, ((path, *signature) for path, signature in state.items()))
+        elif os.path.exists(state_path):
+            os.remove(state_path)
+        return True
+
+    old_state = read_state(state_path)
+    state = {}
+    new_rows = []
+    changed = False
+    for abs_path, path, class_name, entry in rows:
+        signature = get_signature(entry)
+        state[abs_path] = signature
+        if abs_path not in old_state:
+            new_rows.append((abs_path, path, class_name))
+        elif old_state[abs_path] != signature:
+            changed = True
+    deleted = old_state.keys() - state.keys()
+    if not new_rows and not deleted and not changed:
+        return False
+    if deleted:
+        with open(save_path, 'r', newline='', encoding='utf-8') as csv_file:
+            kept = [row for row in csv.reader(csv_file, delimiter='\t') if row[0] not in deleted]
+        replace_file(save_path, kept + new_rows)
+    elif new_rows:
+        with open(save_path, 'a', buffering=WRITE_BUFFER, encoding='utf-8') as csv_file:
+            csv.writer(csv_file, delimiter='\t', lineterminator='\n').writerows(new_rows)
+    replace_file(state_path, ((path, *signature) for path, signature in state.items()))
+    return True
+
+
+def create_annotation(dataset_dir: str, classes: list[str], save_path: str,
+                      incremental: bool = False,
+                      progress: Callable[[int, int | None], None] = None) -> bool:
     """
     Создание аннотации к датасету
     :param dataset_dir: Папка датасета
     :param classes: Классы изображений
     :param save_path: Путь к аннотации
-    :return:
+    :param incremental: Обновлять существующую аннотацию вместо полного пересоздания
+    :param progress: Функция, вызываемая с числом обработанных файлов и общим числом файлов
+    :return: True, если аннотация была изменена
     """
-    if os.path.exists(save_path):
-        os.remove(save_path)
-    for class_name in classes:
-        paths = get_paths(os.path.join(dataset_dir, class_name))
-        abs_paths = get_abs_paths(os.path.join(dataset_dir, class_name))
-        with open(save_path, 'a') as csv_file:
-            writer = csv.writer(csv_file, delimiter='\t', lineterminator='\n')
-            for path, abs_path in zip(paths, abs_paths):
-                writer.writerow([abs_path, path, class_name])
+    class_dirs = [os.path.join(dataset_dir, class_name) for class_name in classes]
+    rows = ((abs_path, path, classes[index], entry)
+            for index, abs_path, path, entry in scan_dirs(class_dirs))
+    return write_annotation(rows, save_path, incremental, progress)
 
 
 if __name__ == "__main__":
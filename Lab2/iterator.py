@@ -1,38 +1,398 @@
+import os
 import csv
+import json
+import mmap
+import queue
+import random
+import tempfile
+import threading
+from array import array
+from collections.abc import Callable, Iterable, Iterator as RowIterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from typing import Any
+
+from columnar import ROWS_FILE, ColumnarAnnotation, is_columnar
+
+CACHE_SIZE = 8
+INDEX_SUFFIX = '.idx'
+BATCH_SIZE = 16
+PREFETCH = 2
+LOAD_WORKERS = 4
+
+
+def get_stamp(path: str) -> tuple[int, int]:
+    """
+    Признаки изменения файла
+    :param path: Путь к файлу
+    :return: Время изменения в наносекундах и размер
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def parse_line(line: bytes) -> list[str]:
+    """
+    Разбор строки аннотации
+    :param line: Строка в байтах
+    :return: Поля строки
+    """
+    text = line.decode()
+    if '"' not in text:
+        return text.rstrip('\r\n').split('\t')
+    return next(csv.reader([text], delimiter='\t'))
+
+
+def build_index(annotation: str) -> dict[str, array]:
+    """
+    Построение индекса смещений строк каждого класса в аннотации TSV
+    :param annotation: Путь к аннотации
+    :return: Словарь класс -> массив смещений строк в байтах
+    """
+    offsets = {}
+    offset = 0
+    with open(annotation, 'rb') as file:
+        for line in file:
+            row = parse_line(line)
+            if len(row) > 2:
+                offsets.setdefault(row[2], array('q')).append(offset)
+            offset += len(line)
+    return offsets
+
+
+def read_index(index_path: str, stamp: tuple[int, int]) -> dict[str, array] | None:
+    """
+    Чтение индекса: строка заголовка JSON с признаками аннотации и размерами массивов,
+    затем массивы смещений в двоичном виде
+    :param index_path: Путь к файлу индекса
+    :param stamp: Текущие признаки изменения аннотации
+    :return: Словарь класс -> массив смещений строк в байтах или None,
+    если индекс устарел или повреждён
+    """
+    offsets = {}
+    try:
+        with open(index_path, 'rb') as index_file:
+            header = json.loads(index_file.readline())
+            if tuple(header['stamp']) != stamp:
+                return None
+            for class_name, count in header['classes']:
+                offsets[class_name] = array('q')
+                offsets[class_name].fromfile(index_file, count)
+    except (OSError, EOFError, ValueError, KeyError, TypeError):
+        return None
+    return offsets
+
+
+def write_index(index_path: str, stamp: tuple[int, int], offsets: dict[str, array]):
+    """
+    Атомарная запись индекса через уникальный временный файл, так что несколько
+    процессов могут сохранять индекс одновременно
+    :param index_path: Путь к файлу индекса
+    :param stamp: Признаки изменения аннотации
+    :param offsets: Словарь класс -> массив смещений строк в байтах
+    :return:
+    """
+    header = {'stamp': stamp,
+              'classes': [[class_name, len(values)] for class_name, values in offsets.items()]}
+    descriptor, temp_path = tempfile.mkstemp('.tmp', os.path.basename(index_path) + '.',
+                                             os.path.dirname(index_path) or '.')
+    try:
+        with open(descriptor, 'wb') as index_file:
+            index_file.write(json.dumps(header).encode() + b'\n')
+            for values in offsets.values():
+                values.tofile(index_file)
+        os.replace(temp_path, index_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_index(annotation: str) -> dict[str, array]:
+    """
+    Загрузка индекса, сохранённого рядом с аннотацией. Если аннотация изменилась,
+    индекс строится заново и сохраняется, если папка аннотации доступна для записи
+    :param annotation: Путь к аннотации
+    :return: Словарь класс -> массив смещений строк в байтах
+    """
+    index_path = annotation + INDEX_SUFFIX
+    stamp = get_stamp(annotation)
+    offsets = read_index(index_path, stamp)
+    if offsets is None:
+        offsets = build_index(annotation)
+        try:
+            write_index(index_path, stamp, offsets)
+        except OSError:
+            pass
+    return offsets
+
+
+class IndexedAnnotation:
+    def __init__(self, annotation: str):
+        """
+        Аннотация TSV с произвольным доступом к строкам по индексу смещений.
+        Файл отображается в память один раз, строки читаются срезами
+        :param annotation: Путь к аннотации
+        """
+        self.annotation = annotation
+        self.offsets = load_index(annotation)
+        self.classes = list(self.offsets)
+        with open(annotation, 'rb') as file:
+            if os.fstat(file.fileno()).st_size:
+                self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = b''
+
+    def class_indices(self, class_name: str) -> array:
+        """
+        Смещения строк класса
+        :param class_name: Класс изображения
+        :return: Массив смещений в байтах
+        """
+        return self.offsets.get(class_name, array('q'))
+
+    def __getitem__(self, offset: int) -> list[str]:
+        end = self.data.find(b'\n', offset)
+        return parse_line(self.data[offset:] if end < 0 else self.data[offset:end + 1])
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def read_annotation(annotation: str, mtime: int,
+                    size: int) -> IndexedAnnotation | ColumnarAnnotation:
+    """
+    Открытие аннотации с индексом классов. Результат кэшируется по пути, времени
+    изменения и размеру, поэтому итераторы по одному файлу загружают индекс один раз
+    :param annotation: Абсолютный путь к аннотации
+    :param mtime: Время изменения в наносекундах
+    :param size: Размер в байтах
+    :return: Аннотация с доступом к строкам по номерам из class_indices
+    """
+    if is_columnar(annotation):
+        return ColumnarAnnotation(annotation)
+    return IndexedAnnotation(annotation)
+
+
+def load_annotation(annotation: str) -> IndexedAnnotation | ColumnarAnnotation:
+    """
+    Получение общей кэшированной аннотации
+    :param annotation: Путь к аннотации датасета (TSV или колоночной)
+    :return: Аннотация с доступом к строкам по номерам из class_indices
+    """
+    stat_path = os.path.join(annotation, ROWS_FILE) if is_columnar(annotation) else annotation
+    return read_annotation(os.path.abspath(annotation), *get_stamp(stat_path))
+
+
+def stream_annotation(annotation: str) -> RowIterator[list[str]]:
+    """
+    Построчное чтение аннотации без загрузки в память
+    :param annotation: Путь к аннотации датасета (TSV или колоночной)
+    :return: Строки аннотации
+    """
+    if is_columnar(annotation):
+        yield from ColumnarAnnotation(annotation)
+        return
+    with open(annotation, mode='r', encoding='utf-8') as file:
+        yield from csv.reader(file, delimiter='\t', lineterminator='\n')
 
 
 class Iterator:
-    def __init__(self, class_name: str, annotation: str):
+    def __init__(self, class_name: str, annotation: str, stream: bool = False,
+                 shuffle: bool = False, seed: int = None, cycle: bool = False,
+                 shard_id: int = 0, num_shards: int = 1):
         """
         Инициализация
         :param class_name: Класс изображения
-        :param annotation: Путь к аннотации датасета
+        :param annotation: Путь к аннотации датасета (TSV или колоночной)
+        :param stream: Читать строки из файла по мере итерации вместо доступа по индексу
+        :param shuffle: Перемешивать изображения в каждой эпохе
+        :param seed: Зерно перемешивания, порядок эпохи определяется зерном и номером эпохи
+        :param cycle: Начинать новую эпоху вместо StopIteration
+        :param shard_id: Номер части, которую обходит итератор
+        :param num_shards: Количество непересекающихся частей аннотации
         """
-        self.dataset = []
-        with open(annotation, mode='r') as file:
-            reader = csv.reader(file, delimiter='\t', lineterminator='\n')
-            for lines in reader:
-                self.dataset.append(lines)
+        if not 0 <= shard_id < num_shards:
+            raise ValueError(f"Invalid shard {shard_id} of {num_shards}")
+        if stream and (shuffle or cycle):
+            raise ValueError("Shuffling and cycling require indexed access, not stream")
         self.class_name = class_name
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.shuffle = shuffle
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.cycle = cycle
+        self.epoch = 0
+        self.order = None
+        self.counter = 0
+        if stream:
+            self.dataset = None
+            self.positions = None
+            self.rows = stream_annotation(annotation)
+            self.matched = 0
+        else:
+            self.dataset = load_annotation(annotation)
+            self.positions = self.dataset.class_indices(class_name)[shard_id::num_shards]
+            self.rows = None
+            self.set_epoch(0)
+
+    def set_epoch(self, epoch: int):
+        """
+        Начало эпохи с заданным номером
+        :param epoch: Номер эпохи
+        :return:
+        """
+        self.epoch = epoch
         self.counter = 0
-        self.limit = len(self.dataset)
+        if self.shuffle:
+            self.order = list(range(len(self.positions)))
+            random.Random(f"{self.seed}-{epoch}").shuffle(self.order)
 
     def __iter__(self):
         return self
 
+    def __len__(self):
+        if self.positions is None:
+            raise TypeError("Streaming iterator has no length")
+        return len(self.positions)
+
+    def __getitem__(self, index: int) -> str:
+        if self.positions is None:
+            raise TypeError("Streaming iterator does not support random access")
+        if self.order is not None:
+            index = self.order[index]
+        return self.dataset[self.positions[index]][0]
+
+    def seek(self, index: int):
+        """
+        Переход к изображению с заданным номером в текущей эпохе
+        :param index: Номер изображения класса
+        :return:
+        """
+        if self.positions is None:
+            raise TypeError("Streaming iterator does not support seek")
+        self.counter = index
+
+    def peek(self, count: int) -> list[str]:
+        """
+        Следующие изображения без продвижения итератора. В режиме cycle без
+        перемешивания список продолжается с начала класса
+        :param count: Количество изображений
+        :return: Список путей
+        """
+        if self.positions is None:
+            raise TypeError("Streaming iterator does not support peek")
+        size = len(self.positions)
+        if self.cycle and not self.shuffle and size:
+            return [self[(self.counter + offset) % size] for offset in range(min(count, size))]
+        return [self[index] for index in range(self.counter, min(self.counter + count, size))]
+
     def __next__(self):
-        while self.counter < self.limit and self.dataset[self.counter][2] != self.class_name:
-            self.counter += 1
-        if self.counter < self.limit:
-            path = self.dataset[self.counter][0]
+        if self.rows is not None:
+            for row in self.rows:
+                if row[2] == self.class_name:
+                    self.matched += 1
+                    if (self.matched - 1) % self.num_shards == self.shard_id:
+                        return row[0]
+            raise StopIteration
+        if self.counter >= len(self.positions) and self.cycle and len(self.positions):
+            self.set_epoch(self.epoch + 1)
+        if self.counter < len(self.positions):
+            path = self[self.counter]
             self.counter += 1
             return path
         else:
             raise StopIteration
 
 
+class BatchIterator:
+    def __init__(self, paths: Iterable[str], batch_size: int = BATCH_SIZE,
+                 loader: Callable[[str], Any] = None, prefetch: int = PREFETCH,
+                 workers: int = LOAD_WORKERS):
+        """
+        Итератор по пакетам путей или загруженных изображений. Следующие пакеты
+        готовятся в фоновом потоке и ограниченной очереди, так что чтение с диска
+        и декодирование идут параллельно с обработкой текущего пакета
+        :param paths: Пути к изображениям, например Iterator
+        :param batch_size: Размер пакета
+        :param loader: Функция загрузки изображения по пути, без неё выдаются пути
+        :param prefetch: Количество заранее подготовленных пакетов
+        :param workers: Количество потоков загрузки
+        """
+        self.batch_size = batch_size
+        self.loader = loader
+        self.workers = workers
+        self.batches = queue.Queue(prefetch)
+        self.stop = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self.produce, args=(iter(paths),), daemon=True)
+        self.thread.start()
+
+    def put(self, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self, paths: RowIterator[str]):
+        """
+        Подготовка пакетов в фоновом потоке
+        :param paths: Пути к изображениям
+        :return:
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while not self.stop.is_set():
+                    batch = list(islice(paths, self.batch_size))
+                    if not batch:
+                        break
+                    if self.loader is not None:
+                        batch = list(executor.map(self.loader, batch))
+                    if not self.put(batch):
+                        return
+            except Exception as exc:
+                self.put(exc)
+                return
+        self.put(None)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> list:
+        if self.finished:
+            raise StopIteration
+        batch = self.batches.get()
+        if batch is None:
+            self.finished = True
+            raise StopIteration
+        if isinstance(batch, Exception):
+            self.finished = True
+            raise batch
+        return batch
+
+    def close(self):
+        """
+        Остановка фоновой подготовки пакетов
+        :return:
+        """
+        self.finished = True
+        self.stop.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 if __name__ == "__main__":
     cat = Iterator("cat", "annotation.csv")
+    print(len(cat), cat[0])
     print(next(cat))
-    for cat in Iterator("cat", "annotation.csv"):
+    for cat in Iterator("cat", "annotation.csv", stream=True):
         print(cat)
+    for batch in BatchIterator(Iterator("dog", "annotation.csv"), loader=os.path.getsize):
+        print(batch)
@@ -0,0 +1,133 @@
+import os
+import csv
+import sys
+import hashlib
+import tempfile
+import time
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QGuiApplication, QImage
+
+from annotation import create_annotation, get_paths, get_abs_paths
+from image_cache import load_scaled
+from iterator import Iterator
+from labels import LabelResolver
+
+
+def create_fake_dataset(dataset_dir: str, classes: list[str], count: int):
+    """
+    Создание датасета из пустых файлов
+    :param dataset_dir: Папка датасета
+    :param classes: Классы изображений
+    :param count: Количество файлов в каждом классе
+    :return:
+    """
+    for class_name in classes:
+        class_path = os.path.join(dataset_dir, class_name)
+        os.makedirs(class_path)
+        for index in range(count):
+            open(os.path.join(class_path, f"{str(index).zfill(4)}.jpg"), "wb").close()
+
+
+def create_annotation_listdir(dataset_dir: str, classes: list[str], save_path: str):
+    """
+    Прежняя реализация create_annotation: два os.listdir и повторное открытие файла на класс
+    """
+    if os.path.exists(save_path):
+        os.remove(save_path)
+    for class_name in classes:
+        paths = get_paths(os.path.join(dataset_dir, class_name))
+        abs_paths = get_abs_paths(os.path.join(dataset_dir, class_name))
+        with open(save_path, 'a', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file, delimiter='\t', lineterminator='\n')
+            for path, abs_path in zip(paths, abs_paths):
+                writer.writerow([abs_path, path, class_name])
+
+
+def measure(function, *args, repeat: int = 3) -> float:
+    """
+    Лучшее время выполнения функции
+    :param function: Функция
+    :param args: Аргументы функции
+    :param repeat: Количество повторов
+    :return: Время в секундах
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_annotation(count: int = 100000, classes: list[str] = None):
+    """
+    Сравнение прежнего и однопроходного построения аннотации
+    :param count: Количество файлов в каждом классе
+    :param classes: Классы изображений
+    :return:
+    """
+    classes = classes or ["cat", "dog"]
+    with tempfile.TemporaryDirectory() as dataset_dir:
+        create_fake_dataset(dataset_dir, classes, count)
+        save_path = os.path.join(dataset_dir, "annotation.csv")
+        old = measure(create_annotation_listdir, dataset_dir, classes, save_path)
+        new = measure(create_annotation, dataset_dir, classes, save_path)
+    print(f"annotation, {count * len(classes)} files: listdir {old:.3f}s, "
+          f"scandir {new:.3f}s, speedup x{old / new:.2f}")
+
+
+def get_class_substring(path: str, classes: list[str]) -> str:
+    """
+    Прежнее определение класса: поиск подстроки для каждого класса
+    """
+    for class_name in classes:
+        if class_name in path:
+            return class_name
+    return ""
+
+
+def benchmark_labels(classes_count: int = 300, count: int = 200000):
+    """
+    Сравнение поиска подстроки и словаря префиксов при определении класса
+    :param classes_count: Количество классов
+    :param count: Количество путей
+    :return:
+    """
+    classes = [hashlib.md5(str(index).encode()).hexdigest()[:8] for index in range(classes_count)]
+    paths = [os.path.join("dataset_copy", f"{classes[index % classes_count]}_{index:07}.jpg")
+             for index in range(count)]
+    resolver = LabelResolver(classes)
+    old = measure(lambda: [get_class_substring(path, classes) for path in paths], repeat=1)
+    new = measure(lambda: [resolver.resolve(path) for path in paths], repeat=1)
+    print(f"labels, {classes_count} classes, {count} files: substring {old:.3f}s, "
+          f"prefix dict {new:.3f}s, speedup x{old / new:.2f}")
+
+
+def load_full(path: str, width: int, height: int) -> QImage:
+    """
+    Прежняя загрузка: декодирование полного изображения и последующее уменьшение
+    """
+    return QImage(path).scaled(width, height, Qt.KeepAspectRatio)
+
+
+def benchmark_decode(paths: list[str], width: int = 800, height: int = 600):
+    """
+    Сравнение полного декодирования с уменьшением и декодирования в размере области
+    :param paths: Пути к изображениям
+    :param width: Ширина области
+    :param height: Высота области
+    :return:
+    """
+    old = measure(lambda: [load_full(path, width, height) for path in paths])
+    new = measure(lambda: [load_scaled(path, width, height) for path in paths])
+    count = len(paths)
+    print(f"decode, {count} images to {width}x{height}: full {old / count * 1000:.1f}ms, "
+          f"scaled {new / count * 1000:.1f}ms per image, speedup x{old / new:.2f}")
+
+
+if __name__ == "__main__":
+    benchmark_annotation()
+    benchmark_labels()
+    app = QGuiApplication(sys.argv)
+    benchmark_decode(sys.argv[1:] or Iterator("cat", "annotation.csv").peek(50))
@@ -0,0 +1,212 @@
+import os
+import math
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+RADIUS = 6
+
+
+def average_hash(image: Image.Image) -> int:
+    """
+    Вычисление aHash
+    :param image: Изображение
+    :return: 64-битный хэш
+    """
+    pixels = np.asarray(image.convert("L").resize((HASH_SIZE, HASH_SIZE), Image.LANCZOS),
+                        dtype=np.float64)
+    return bits_to_int(pixels > pixels.mean())
+
+
+def difference_hash(image: Image.Image) -> int:
+    """
+    Вычисление dHash
+    :param image: Изображение
+    :return: 64-битный хэш
+    """
+    pixels = np.asarray(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS),
+                        dtype=np.float64)
+    return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    Вычисление pHash по низкочастотным коэффициентам ДКП
+    :param image: Изображение
+    :return: 64-битный хэш
+    """
+    size = HASH_SIZE * 4
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS),
+                        dtype=np.float64)
+    dct = dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    return bits_to_int(low > np.median(low.flatten()[1:]))
+
+
+def dct_matrix(size: int) -> np.ndarray:
+    """
+    Матрица ДКП-II
+    :param size: Размер матрицы
+    :return: Матрица
+    """
+    k = np.arange(size).reshape(-1, 1)
+    n = np.arange(size).reshape(1, -1)
+    return np.cos(math.pi * (2 * n + 1) * k / (2 * size))
+
+
+def bits_to_int(bits: np.ndarray) -> int:
+    """
+    Упаковка битовой матрицы в число
+    :param bits: Матрица логических значений
+    :return: Хэш
+    """
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(first: int, second: int) -> int:
+    """
+    Расстояние Хэмминга между хэшами
+    """
+    return (first ^ second).bit_count()
+
+
+METHODS = {"ahash": average_hash, "dhash": difference_hash, "phash": perceptual_hash}
+
+
+class BKTree:
+    def __init__(self):
+        """
+        Инициализация пустого BK-дерева по расстоянию Хэмминга
+        """
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, item: str):
+        """
+        Добавление хэша
+        :param value: Хэш
+        :param item: Связанный с хэшем объект (путь к изображению)
+        :return:
+        """
+        self.size += 1
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, item, {})
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list[tuple[int, str]]:
+        """
+        Поиск хэшей в пределах радиуса
+        :param value: Хэш
+        :param radius: Максимальное расстояние Хэмминга
+        :return: Список пар (расстояние, объект), отсортированный по расстоянию
+        """
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_value, node_item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.append((distance, node_item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return sorted(found)
+
+    def __len__(self):
+        return self.size
+
+
+class DuplicateIndex:
+    def __init__(self, radius: int = RADIUS, method: str = "dhash"):
+        """
+        Инициализация индекса почти-дубликатов
+        :param radius: Максимальное расстояние Хэмминга между дубликатами
+        :param method: Перцептивный хэш: ahash, dhash или phash
+        """
+        self.radius = radius
+        self.hash_function = METHODS[method]
+        self.tree = BKTree()
+
+    def hash_file(self, path: str) -> int:
+        """
+        Хэш изображения из файла
+        """
+        with Image.open(path) as image:
+            return self.hash_function(image)
+
+    def find(self, value: int) -> str | None:
+        """
+        Поиск ближайшего почти-дубликата
+        :param value: Хэш
+        :return: Путь к найденному изображению или None
+        """
+        found = self.tree.search(value, self.radius)
+        return found[0][1] if found else None
+
+    def add(self, value: int, item: str):
+        """
+        Добавление изображения в индекс
+        """
+        self.tree.add(value, item)
+
+    def add_directory(self, path: str):
+        """
+        Добавление в индекс всех изображений папки
+        :param path: Путь к папке с изображениями
+        :return:
+        """
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            try:
+                self.add(self.hash_file(file_path), file_path)
+            except OSError:
+                continue
+
+
+def find_duplicates(dataset_dir: str, classes: list[str], radius: int = RADIUS,
+                    method: str = "dhash", remove: bool = False) -> list[tuple[str, str, int]]:
+    """
+    Поиск почти-дубликатов в существующем датасете, в том числе между классами
+    :param dataset_dir: Папка датасета
+    :param classes: Классы изображений
+    :param radius: Максимальное расстояние Хэмминга между дубликатами
+    :param method: Перцептивный хэш: ahash, dhash или phash
+    :param remove: Удалять найденные дубликаты
+    :return: Список троек (дубликат, оригинал, расстояние)
+    """
+    index = DuplicateIndex(radius, method)
+    duplicates = []
+    for class_name in classes:
+        class_path = os.path.join(dataset_dir, class_name)
+        for name in sorted(os.listdir(class_path)):
+            file_path = os.path.join(class_path, name)
+            try:
+                value = index.hash_file(file_path)
+            except OSError:
+                continue
+            found = index.tree.search(value, radius)
+            if found:
+                distance, original = found[0]
+                duplicates.append((file_path, original, distance))
+                if remove:
+                    os.remove(file_path)
+            else:
+                index.add(value, file_path)
+    return duplicates
+
+
+if __name__ == "__main__":
+    for duplicate, original, distance in find_duplicates("dataset", ["cat", "dog"]):
+        print(f"{duplicate}\t{original}\t{distance}")
@@ -0,0 +1,174 @@
+import os
+from collections.abc import Callable
+
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QObject, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QColor, QImage, QPixmap
+from PyQt5.QtWidgets import QComboBox, QListView, QVBoxLayout, QWidget
+
+from image_cache import ImageCache
+from iterator import Iterator
+
+CELL_SIZE = 160
+BATCH_SIZE = 200
+
+
+class LoadSignals(QObject):
+    loaded = pyqtSignal(str, QImage)
+
+
+class GalleryModel(QAbstractListModel):
+    def __init__(self, iterator: Iterator, cache: ImageCache, signals: LoadSignals,
+                 cell_size: int = CELL_SIZE):
+        """
+        Модель галереи изображений одного класса. Строки берутся из итератора
+        по номеру, миниатюры загружаются в фоне только для тех ячеек, которые
+        представление запрашивает для отрисовки
+        :param iterator: Итератор класса с доступом по номеру
+        :param cache: Кэш изображений
+        :param signals: Сигналы о загруженных изображениях
+        :param cell_size: Размер миниатюры
+        """
+        super().__init__()
+        self.iterator = iterator
+        self.cache = cache
+        self.cell_size = cell_size
+        self.paths = {}
+        self.requested = {}
+        self.failed = set()
+        self.signals = signals
+        self.signals.loaded.connect(self.on_loaded)
+        self.placeholder = QPixmap(cell_size, cell_size)
+        self.placeholder.fill(QColor(Qt.lightGray))
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.iterator)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.get_path(index.row())
+        if role == Qt.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ToolTipRole:
+            return path
+        if role == Qt.DecorationRole:
+            image = self.cache.get(path, self.cell_size, self.cell_size)
+            if image is not None:
+                return QPixmap.fromImage(image)
+            if path not in self.failed and path not in self.requested:
+                tasks = self.cache.prefetch([path], self.cell_size, self.cell_size,
+                                            self.signals.loaded.emit)
+                if tasks:
+                    self.requested[path] = (index.row(), tasks[0])
+            return self.placeholder
+        return None
+
+    def get_path(self, row: int) -> str:
+        """
+        Путь к изображению строки, прочитанный из аннотации один раз
+        :param row: Номер строки
+        :return: Путь к изображению
+        """
+        path = self.paths.get(row)
+        if path is None:
+            path = self.paths[row] = self.iterator[row]
+        return path
+
+    def on_loaded(self, path: str, image: QImage):
+        """
+        Обновление ячейки после фоновой загрузки миниатюры
+        :param path: Путь к изображению
+        :param image: Загруженное изображение, пустое, если файл не удалось прочитать
+        :return:
+        """
+        request = self.requested.pop(path, None)
+        if request is None:
+            return
+        row = request[0]
+        if image.isNull():
+            self.failed.add(path)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def cancel_requests(self, visible: Callable[[int], bool]):
+        """
+        Отмена стоящих в очереди загрузок для ячеек, которые больше не видны
+        :param visible: Функция, проверяющая, видна ли строка
+        :return:
+        """
+        hidden = [path for path, (row, _) in self.requested.items() if not visible(row)]
+        self.cache.cancel(self.requested.pop(path)[1] for path in hidden)
+
+    def close(self):
+        """
+        Отключение модели: загрузки из очереди отменяются, сигналы отсоединяются
+        :return:
+        """
+        self.cancel_requests(lambda row: False)
+        self.signals.loaded.disconnect(self.on_loaded)
+
+
+class GalleryWindow(QWidget):
+    def __init__(self, annotation: str, classes: list[str], cache: ImageCache):
+        """
+        Окно галереи
+        :param annotation: Путь к аннотации датасета
+        :param classes: Классы изображений
+        :param cache: Кэш изображений
+        """
+        super().__init__()
+        self.annotation = annotation
+        self.cache = cache
+        self.signals = LoadSignals(self)
+        self.model = None
+        self.setWindowTitle('Gallery')
+        self.resize(1000, 800)
+
+        self.class_box = QComboBox(self)
+        self.class_box.addItems(classes)
+        self.class_box.currentTextChanged.connect(self.show_class)
+
+        self.view = QListView(self)
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(BATCH_SIZE)
+        self.view.setIconSize(QSize(CELL_SIZE, CELL_SIZE))
+        self.view.setGridSize(QSize(CELL_SIZE + 20, CELL_SIZE + 30))
+        self.view.verticalScrollBar().valueChanged.connect(lambda _: self.cancel_hidden())
+
+        vbox = QVBoxLayout()
+        vbox.addWidget(self.class_box)
+        vbox.addWidget(self.view)
+        self.setLayout(vbox)
+        self.show_class(self.class_box.currentText())
+
+    def show_class(self, class_name: str):
+        """
+        Показ изображений класса
+        :param class_name: Класс изображения
+        :return:
+        """
+        if self.model is not None:
+            self.model.close()
+        self.model = GalleryModel(Iterator(class_name, self.annotation), self.cache,
+                                  self.signals)
+        self.view.setModel(self.model)
+
+    def cancel_hidden(self):
+        """
+        Отмена загрузок миниатюр, прокрученных за пределы окна. Очередь загрузок
+        основного окна не затрагивается
+        :return:
+        """
+        viewport = self.view.viewport().rect()
+        self.model.cancel_requests(
+            lambda row: self.view.visualRect(self.model.index(row)).intersects(viewport))
+
+    def closeEvent(self, event):
+        if self.model is not None:
+            self.model.close()
+            self.model = None
+        super().closeEvent(event)
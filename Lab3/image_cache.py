@@ -0,0 +1,190 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+
+from PyQt5.QtCore import QRunnable, QThreadPool, Qt
+from PyQt5.QtGui import QImage, QImageReader
+
+CACHE_BUDGET = 64 * 1024 * 1024
+PREFETCH_COUNT = 4
+PREFETCH_WORKERS = 2
+RESIZE_THRESHOLD = 0.1
+
+
+def load_scaled(path: str, width: int, height: int) -> QImage:
+    """
+    Загрузка изображения сразу в размере области просмотра. Большие изображения
+    уменьшаются при декодировании (для JPEG в частотной области), так что полный
+    кадр не раскодируется и не хранится в памяти
+    :param path: Путь к изображению
+    :param width: Ширина области
+    :param height: Высота области
+    :return: Изображение, пустое, если файл не удалось прочитать
+    """
+    reader = QImageReader(path)
+    size = reader.size()
+    if size.isValid() and (size.width() > width or size.height() > height):
+        reader.setScaledSize(size.scaled(width, height, Qt.KeepAspectRatio))
+        return reader.read()
+    image = reader.read()
+    if image.isNull():
+        return image
+    return image.scaled(width, height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def get_display_size(old: tuple[int, int] | None, new: tuple[int, int],
+                     threshold: float = RESIZE_THRESHOLD) -> tuple[int, int]:
+    """
+    Размер, под который декодируются изображения. Он меняется, только если область
+    просмотра изменилась заметно, чтобы мелкие изменения размера окна не вызывали
+    повторного декодирования
+    :param old: Текущий размер или None
+    :param new: Новый размер области
+    :param threshold: Относительное изменение, после которого размер обновляется
+    :return: Размер (ширина, высота)
+    """
+    if old is None:
+        return new
+    for old_side, new_side in zip(old, new):
+        if abs(new_side - old_side) > old_side * threshold:
+            return new
+    return old
+
+
+class LoadTask(QRunnable):
+    def __init__(self, cache: 'ImageCache', path: str, width: int, height: int,
+                 callback: Callable[[str, QImage], None] = None):
+        # Задачу удаляет Python, а не пул: кэш держит её, пока она в очереди или
+        # выполняется, поэтому её можно безопасно снять с очереди через tryTake
+        super().__init__()
+        self.setAutoDelete(False)
+        self.cache = cache
+        self.path = path
+        self.width = width
+        self.height = height
+        self.callback = callback
+
+    def run(self):
+        image = QImage()
+        try:
+            image = self.cache.load(self.path, self.width, self.height)
+        finally:
+            self.cache.finish(self.path, self.width, self.height)
+            if self.callback is not None:
+                self.callback(self.path, image)
+
+
+class ImageCache:
+    def __init__(self, budget: int = CACHE_BUDGET,
+                 loader: Callable[[str, int, int], QImage] = load_scaled,
+                 workers: int = PREFETCH_WORKERS):
+        """
+        LRU-кэш уменьшенных изображений с ограничением по памяти. Изображения хранятся
+        как QImage, так как их, в отличие от QPixmap, можно готовить в фоновых потоках
+        :param budget: Максимальный объём изображений в кэше в байтах
+        :param loader: Функция загрузки изображения по пути и размеру области
+        :param workers: Количество потоков предзагрузки
+        """
+        self.budget = budget
+        self.loader = loader
+        self.images = OrderedDict()
+        self.size = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread_pool = QThreadPool()
+        self.thread_pool.setMaxThreadCount(workers)
+        self.store = None
+
+    def get(self, path: str, width: int, height: int) -> QImage | None:
+        """
+        Изображение из кэша
+        :return: Изображение или None, если его нет в кэше
+        """
+        key = (path, width, height)
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
+
+    def put(self, path: str, width: int, height: int, image: QImage):
+        """
+        Добавление изображения с вытеснением давно не использованных
+        :return:
+        """
+        key = (path, width, height)
+        size = image.sizeInBytes()
+        if size > self.budget:
+            return
+        with self.lock:
+            old = self.images.pop(key, None)
+            if old is not None:
+                self.size -= old.sizeInBytes()
+            self.images[key] = image
+            self.size += size
+            while self.size > self.budget:
+                _, evicted = self.images.popitem(last=False)
+                self.size -= evicted.sizeInBytes()
+
+    def load(self, path: str, width: int, height: int) -> QImage:
+        """
+        Изображение из кэша, хранилища миниатюр или с диска
+        :param path: Путь к изображению
+        :param width: Ширина области
+        :param height: Высота области
+        :return: Изображение
+        """
+        image = self.get(path, width, height)
+        if image is not None:
+            return image
+        if self.store is not None:
+            image = self.store.load(path, width, height)
+        if image is None:
+            image = self.loader(path, width, height)
+        if not image.isNull():
+            self.put(path, width, height, image)
+        return image
+
+    def prefetch(self, paths: Iterable[str], width: int, height: int,
+                 callback: Callable[[str, QImage], None] = None) -> list[LoadTask]:
+        """
+        Фоновая загрузка изображений, которые скоро понадобятся
+        :param paths: Пути к изображениям
+        :param width: Ширина области
+        :param height: Высота области
+        :param callback: Функция, вызываемая в фоновом потоке с путём и загруженным
+        изображением, пустым, если файл не удалось прочитать
+        :return: Поставленные в очередь задачи. Изображения, которые уже есть в кэше
+        или уже загружаются, пропускаются
+        """
+        tasks = []
+        for path in paths:
+            key = (path, width, height)
+            with self.lock:
+                if key in self.images or key in self.pending:
+                    continue
+                task = self.pending[key] = LoadTask(self, path, width, height, callback)
+            self.thread_pool.start(task)
+            tasks.append(task)
+        return tasks
+
+    def finish(self, path: str, width: int, height: int):
+        with self.lock:
+            self.pending.pop((path, width, height), None)
+
+    def cancel(self, tasks: Iterable[LoadTask]):
+        """
+        Отмена загрузок, ещё стоящих в очереди. Уже выполняющиеся загрузки
+        завершаются как обычно
+        :param tasks: Задачи, полученные от prefetch
+        :return:
+        """
+        for task in tasks:
+            if self.thread_pool.tryTake(task):
+                self.finish(task.path, task.width, task.height)
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
@@ -1,14 +1,46 @@
 import os
 import sys
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThreadPool
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import *
 
 from annotation import create_annotation
 from copy_images import create_dataset_copy, create_copy_annotation
 from random_dataset import create_dataset_random, create_random_annotation
+from gallery import GalleryWindow
+from image_cache import CACHE_BUDGET, PREFETCH_COUNT, ImageCache, get_display_size
 from iterator import Iterator
+from thumbnails import THUMBNAILS_FILE, ThumbnailStore, build_thumbnails
+from workers import Worker
+
+CLASSES = ["cat", "dog"]
+
+
+def copy_dataset_task(old_path: str, new_path: str, progress=None):
+    """
+    Создание копии датасета и аннотации к ней
+    :param old_path: Путь к исходному датасету
+    :param new_path: Путь к копии
+    :param progress: Функция прогресса
+    :return:
+    """
+    create_dataset_copy(old_path, new_path, CLASSES, progress=progress)
+    create_copy_annotation(new_path, CLASSES, os.path.join(new_path, "annotation.csv"),
+                           progress=progress)
+
+
+def random_dataset_task(old_path: str, new_path: str, progress=None):
+    """
+    Создание перемешанного датасета и аннотации к нему
+    :param old_path: Путь к копии датасета
+    :param new_path: Путь к новому датасету
+    :param progress: Функция прогресса
+    :return:
+    """
+    classes_dict = create_dataset_random(old_path, new_path, CLASSES, progress=progress)
+    create_random_annotation(new_path, classes_dict, os.path.join(new_path, "annotation.csv"),
+                             progress=progress)
 
 
 class MainWindow(QMainWindow):
@@ -17,6 +49,9 @@ class MainWindow(QMainWindow):
 
         self.dataset_path = None
         self.annotation_path = None
+        self.image_cache = ImageCache(CACHE_BUDGET)
+        self.display_size = None
+        self.current_image = None
 
         self.__init_ui()
         self.__create_action()
@@ -25,6 +60,9 @@ class MainWindow(QMainWindow):
         self.cat_iter = None
         self.dog_iter = None
 
+        self.thread_pool = QThreadPool.globalInstance()
+        self.worker = None
+
     def __init_ui(self):
         self.resize(1000, 800)
         self.center()
@@ -50,6 +88,14 @@ class MainWindow(QMainWindow):
         vbox.addLayout(hbox)
 
         self.centralWidget.setLayout(vbox)
+
+        self.progress_bar = QProgressBar(self)
+        self.cancel_btn = QPushButton('Cancel', self)
+        self.cancel_btn.clicked.connect(self.cancel_task)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_btn)
+        self.progress_bar.hide()
+        self.cancel_btn.hide()
         self.show()
 
     @staticmethod
@@ -66,17 +112,14 @@ class MainWindow(QMainWindow):
         if self.annotation_path is None:
             self.get_message_box("Please, create annotation")
             return
-        lbl_size = self.lbl.size()
 
-        try:
-            next_image = next(self.cat_iter)
-            img = QPixmap(next_image).scaled(
-                lbl_size, aspectRatioMode=Qt.KeepAspectRatio)
-            self.lbl.setPixmap(img)
-            self.lbl.setAlignment(Qt.AlignCenter)
-        except:
-            self.cat_iter = Iterator("cat", self.annotation_path)
-            self.next_cat()
+        if self.cat_iter is None:
+            self.cat_iter = Iterator("cat", self.annotation_path, cycle=True)
+        next_image = next(self.cat_iter, None)
+        if next_image is None:
+            self.get_message_box("No images of this class")
+            return
+        self.show_image(next_image, self.cat_iter)
 
     def next_dog(self):
         if self.dataset_path is None:
@@ -86,16 +129,39 @@ class MainWindow(QMainWindow):
             self.get_message_box("Please, create annotation")
             return
 
+        if self.dog_iter is None:
+            self.dog_iter = Iterator("dog", self.annotation_path, cycle=True)
+        next_image = next(self.dog_iter, None)
+        if next_image is None:
+            self.get_message_box("No images of this class")
+            return
+        self.show_image(next_image, self.dog_iter)
+
+    def show_image(self, path: str, iterator: Iterator):
+        """
+        Показ изображения из кэша и предзагрузка следующих изображений класса
+        :param path: Путь к изображению
+        :param iterator: Итератор класса
+        :return:
+        """
+        lbl_size = self.lbl.size()
+        self.display_size = get_display_size(self.display_size,
+                                             (lbl_size.width(), lbl_size.height()))
+        width, height = self.display_size
+        img = QPixmap.fromImage(self.image_cache.load(path, width, height))
+        self.lbl.setPixmap(img)
+        self.lbl.setAlignment(Qt.AlignCenter)
+        self.current_image = (path, iterator)
+        self.image_cache.prefetch(iterator.peek(PREFETCH_COUNT), width, height)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.current_image is None:
+            return
         lbl_size = self.lbl.size()
-        try:
-            next_image = next(self.dog_iter)
-            img = QPixmap(next_image).scaled(
-                lbl_size, aspectRatioMode=Qt.KeepAspectRatio)
-            self.lbl.setPixmap(img)
-            self.lbl.setAlignment(Qt.AlignCenter)
-        except:
-            self.dog_iter = Iterator("dog", self.annotation_path)
-            self.next_dog()
+        new_size = (lbl_size.width(), lbl_size.height())
+        if get_display_size(self.display_size, new_size) != self.display_size:
+            self.show_image(*self.current_image)
 
     def center(self):
         qr = self.frameGeometry()
@@ -115,6 +181,9 @@ class MainWindow(QMainWindow):
         self.dataMenu = menu_bar.addMenu('&Datasets')
         self.dataMenu.addAction(self.createData2Action)
 
+        self.viewMenu = menu_bar.addMenu('&View')
+        self.viewMenu.addAction(self.galleryAction)
+
     def __create_action(self):
         self.exitAction = QAction('&Exit')
         self.exitAction.triggered.connect(qApp.quit)
@@ -131,32 +200,44 @@ class MainWindow(QMainWindow):
         self.createData3Action = QAction('&Create random dataset')
         self.createData3Action.triggered.connect(self.create_random_dataset)
 
+        self.galleryAction = QAction('&Gallery')
+        self.galleryAction.triggered.connect(self.show_gallery)
+
     def __create_annotation(self):
         if self.dataset_path is None:
             self.get_message_box("Please, select dataset")
             return
-        self.annotation_path = QFileDialog.getSaveFileName(self, 'Create file', filter="(*.csv)")[0]
-        create_annotation(self.dataset_path, ["cat", "dog"], self.annotation_path)
-        mb = QMessageBox()
-        mb.setWindowTitle("Message")
-        mb.setText("Task completed")
-        mb.exec()
+        annotation_path = QFileDialog.getSaveFileName(self, 'Create file', filter="(*.csv)")[0]
+        if not annotation_path:
+            return
+
+        def on_finished(_):
+            self.annotation_path = annotation_path
+            self.cat_iter = None
+            self.dog_iter = None
+            self.image_cache.clear()
+            self.current_image = None
+            self.task_completed()
+
+        self.start_task(Worker(create_annotation, self.dataset_path, CLASSES, annotation_path),
+                        on_finished)
 
     def create_copy_dataset(self):
         if self.dataset_path is None:
             self.get_message_box("Please, select base dataset")
             return
-        self.dataset_copy_path = QFileDialog.getExistingDirectory(self, 'Select Folder')
-        self.dataset_copy_path = os.path.relpath(self.dataset_copy_path)
-        create_dataset_copy(self.dataset_path, self.dataset_copy_path, ["cat", "dog"])
-        create_copy_annotation(self.dataset_copy_path, ["cat", "dog"],
-                               os.path.join(self.dataset_copy_path, "annotation.csv"))
+        dataset_copy_path = QFileDialog.getExistingDirectory(self, 'Select Folder')
+        if not dataset_copy_path:
+            return
+        dataset_copy_path = os.path.relpath(dataset_copy_path)
 
-        self.dataMenu.addAction(self.createData3Action)
-        mb = QMessageBox()
-        mb.setWindowTitle("Message")
-        mb.setText("Task completed")
-        mb.exec()
+        def on_finished(_):
+            self.dataset_copy_path = dataset_copy_path
+            self.dataMenu.addAction(self.createData3Action)
+            self.task_completed()
+
+        self.start_task(Worker(copy_dataset_task, self.dataset_path, dataset_copy_path),
+                        on_finished)
 
     def create_random_dataset(self):
         if self.dataset_path is None:
@@ -164,23 +245,109 @@ class MainWindow(QMainWindow):
             return
 
         dataset_path = QFileDialog.getExistingDirectory(self, 'Select Folder')
+        if not dataset_path:
+            return
         dataset_path = os.path.relpath(dataset_path)
-        classes_dict = create_dataset_random(self.dataset_copy_path, dataset_path, ["cat", "dog"])
-        create_random_annotation(dataset_path, classes_dict,
-                                 os.path.join(dataset_path, "annotation.csv"))
-        mb = QMessageBox()
-        mb.setWindowTitle("Message")
-        mb.setText("Task completed")
-        mb.exec()
+        self.start_task(Worker(random_dataset_task, self.dataset_copy_path, dataset_path),
+                        lambda _: self.task_completed())
+
+    def start_task(self, worker: Worker, on_finished):
+        """
+        Запуск долгой операции в пуле потоков. Пока она выполняется, меню недоступно,
+        а в строке состояния показываются прогресс и кнопка отмены
+        :param worker: Задача
+        :param on_finished: Обработчик успешного завершения
+        :return:
+        """
+        self.worker = worker
+        worker.signals.progress.connect(self.show_progress)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.failed.connect(self.task_failed)
+        worker.signals.cancelled.connect(self.task_cancelled)
+        self.set_busy(True)
+        self.thread_pool.start(worker)
+
+    def set_busy(self, busy: bool):
+        self.menuBar().setEnabled(not busy)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(busy)
+        self.cancel_btn.setVisible(busy)
+        self.cancel_btn.setEnabled(busy)
+        if busy:
+            self.statusBar().showMessage("Working...")
+        else:
+            self.worker = None
+
+    def show_progress(self, done: int, total: int):
+        if total < 0:
+            self.progress_bar.setRange(0, 0)
+        else:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(done)
+        self.statusBar().showMessage(f"Processed: {done}")
+
+    def cancel_task(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_btn.setEnabled(False)
+            self.statusBar().showMessage("Cancelling...")
+
+    def task_completed(self):
+        self.set_busy(False)
+        self.statusBar().showMessage("Task completed", 5000)
+
+    def task_cancelled(self):
+        self.set_busy(False)
+        self.statusBar().showMessage("Task cancelled", 5000)
+
+    def task_failed(self, message: str):
+        self.set_busy(False)
+        self.statusBar().clearMessage()
+        self.get_message_box(f"Task failed:\n{message}")
+
+    def show_gallery(self):
+        if self.annotation_path is None:
+            self.get_message_box("Please, create annotation")
+            return
+        self.gallery = GalleryWindow(self.annotation_path, CLASSES, self.image_cache)
+        self.gallery.show()
 
     def select_dataset(self):
-        self.dataset_path = QFileDialog.getExistingDirectory(self, 'Select Folder')
-        self.dataset_path = os.path.relpath(self.dataset_path)
+        dataset_path = QFileDialog.getExistingDirectory(self, 'Select Folder')
+        if not dataset_path:
+            return
+        self.dataset_path = os.path.relpath(dataset_path)
+        self.set_thumbnail_store(None)
+        dataset_path = self.dataset_path
+
+        def on_finished(created: int):
+            store_path = os.path.join(dataset_path, THUMBNAILS_FILE)
+            if os.path.exists(store_path):
+                self.set_thumbnail_store(ThumbnailStore(store_path))
+            self.task_completed()
+            self.statusBar().showMessage(f"Thumbnails created: {created}", 5000)
+
+        self.start_task(Worker(build_thumbnails, dataset_path, CLASSES), on_finished)
+
+    def set_thumbnail_store(self, store: ThumbnailStore | None):
+        """
+        Подключение хранилища миниатюр к кэшу изображений
+        :param store: Хранилище или None
+        :return:
+        """
+        old_store = self.image_cache.store
+        self.image_cache.store = store
+        self.image_cache.clear()
+        if old_store is not None:
+            self.image_cache.thread_pool.waitForDone()
+            old_store.close()
 
     def closeEvent(self, event):
         reply = QMessageBox.question(self, 'Message', "Are you sure to quit?", QMessageBox.Yes |
                                      QMessageBox.No)
         if reply == QMessageBox.Yes:
+            if self.worker is not None:
+                self.worker.cancel()
             event.accept()
         else:
             event.ignore()
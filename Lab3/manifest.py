@@ -0,0 +1,87 @@
+import sqlite3
+
+
+class Manifest:
+    def __init__(self, path: str):
+        """
+        Инициализация
+        :param path: Путь к файлу манифеста
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                file TEXT,
+                key TEXT NOT NULL,
+                page INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS images_hash ON images (hash);
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                page INTEGER NOT NULL
+            );
+        """)
+
+    def has_url(self, url: str) -> bool:
+        """
+        Проверка, скачивалось ли изображение
+        :param url: Ссылка на изображение
+        :return: True, если ссылка уже есть в манифесте
+        """
+        row = self.connection.execute("SELECT 1 FROM images WHERE url = ?", (url,)).fetchone()
+        return row is not None
+
+    def find_hash(self, digest: str) -> str | None:
+        """
+        Поиск сохранённого изображения с таким же содержимым
+        :param digest: Хэш содержимого
+        :return: Путь к файлу или None
+        """
+        row = self.connection.execute(
+            "SELECT file FROM images WHERE hash = ? AND file IS NOT NULL", (digest,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, url: str, digest: str, file: str | None, key: str, page: int):
+        """
+        Запись изображения в манифест
+        :param url: Ссылка на изображение
+        :param digest: Хэш содержимого
+        :param file: Путь к сохранённому файлу, None для пропущенного дубликата
+        :param key: Класс изображения
+        :param page: Страница поиска
+        :return:
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?)",
+                                    (url, digest, file, key, page))
+
+    def complete_page(self, key: str, page: int):
+        """
+        Отметка о странице, до которой включительно полностью обработаны все страницы
+        :param key: Класс изображения
+        :param page: Страница поиска
+        :return:
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO pages VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET page = max(page, excluded.page)", (key, page))
+
+    def last_page(self, key: str) -> int | None:
+        """
+        Последняя полностью обработанная страница
+        :param key: Класс изображения
+        :return: Номер страницы или None
+        """
+        row = self.connection.execute("SELECT page FROM pages WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,194 @@
+import os
+import sqlite3
+import sys
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import QBuffer, QByteArray, QIODevice, QSize, Qt
+from PyQt5.QtGui import QGuiApplication, QImage, QImageReader
+
+from annotation import scan_dirs
+
+THUMBNAILS_FILE = 'thumbnails.db'
+THUMBNAIL_SIZE = 1024
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_WORKERS = 4
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+
+def encode_thumbnail(path: str, size: int = THUMBNAIL_SIZE) -> tuple[int, int, bytes] | None:
+    """
+    Создание миниатюры: изображение уменьшается при декодировании так, чтобы большая
+    сторона не превышала size, и сохраняется в JPEG
+    :param path: Путь к изображению
+    :param size: Максимальная сторона миниатюры
+    :return: Ширина и высота исходного изображения и данные JPEG или None,
+    если файл не удалось прочитать
+    """
+    reader = QImageReader(path)
+    original = reader.size()
+    if original.isValid() and (original.width() > size or original.height() > size):
+        reader.setScaledSize(original.scaled(size, size, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return None
+    if not original.isValid():
+        original = image.size()
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    image.save(buffer, "JPEG", THUMBNAIL_QUALITY)
+    buffer.close()
+    return original.width(), original.height(), bytes(data)
+
+
+class ThumbnailStore:
+    def __init__(self, path: str):
+        """
+        Инициализация хранилища миниатюр
+        :param path: Путь к файлу базы SQLite
+        """
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                path TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                data BLOB NOT NULL
+            );
+        """)
+
+    def stamps(self) -> dict[str, int]:
+        """
+        Время изменения файлов, для которых есть миниатюры
+        :return: Словарь абсолютный путь -> время изменения в наносекундах
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT path, mtime FROM thumbnails"))
+
+    def get(self, path: str, mtime: int) -> tuple[int, int, bytes] | None:
+        """
+        Поиск миниатюры
+        :param path: Абсолютный путь к изображению
+        :param mtime: Текущее время изменения файла в наносекундах
+        :return: Ширина и высота исходного изображения и данные JPEG или None,
+        если миниатюры нет или файл изменился
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT width, height, data FROM thumbnails WHERE path = ? AND mtime = ?",
+                (path, mtime)).fetchone()
+        return row
+
+    def add(self, rows: list[tuple[str, int, int, int, bytes]]):
+        """
+        Запись миниатюр одной транзакцией
+        :param rows: Пятёрки (путь, время изменения, ширина, высота, данные JPEG)
+        :return:
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?)", rows)
+
+    def remove(self, paths: list[str]):
+        """
+        Удаление миниатюр файлов, которых больше нет
+        :param paths: Абсолютные пути
+        :return:
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM thumbnails WHERE path = ?",
+                                        ((path,) for path in paths))
+
+    def load(self, path: str, width: int, height: int) -> QImage | None:
+        """
+        Загрузка изображения в размере области просмотра из миниатюры
+        :param path: Абсолютный путь к изображению
+        :param width: Ширина области
+        :param height: Высота области
+        :return: Изображение или None, если миниатюры нет, она устарела
+        или слишком мала для этой области
+        """
+        try:
+            row = self.get(path, os.stat(path).st_mtime_ns)
+        except OSError:
+            return None
+        if row is None:
+            return None
+        original_width, original_height, data = row
+        target = QSize(original_width, original_height).scaled(width, height,
+                                                               Qt.KeepAspectRatio)
+        buffer = QBuffer()
+        buffer.setData(data)
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+        if target.width() > reader.size().width() and original_width > reader.size().width():
+            return None
+        reader.setScaledSize(target)
+        image = reader.read()
+        return None if image.isNull() else image
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def make_row(job: tuple[str, int], size: int) -> tuple[str, int, int, int, bytes] | None:
+    path, mtime = job
+    thumbnail = encode_thumbnail(path, size)
+    return None if thumbnail is None else (path, mtime, *thumbnail)
+
+
+def build_thumbnails(dataset_dir: str, classes: list[str], size: int = THUMBNAIL_SIZE,
+                     workers: int = THUMBNAIL_WORKERS,
+                     progress: Callable[[int, int | None], None] = None) -> int:
+    """
+    Параллельное создание миниатюр датасета: изображений в папках классов и в самой
+    папке датасета (копии датасета хранят изображения без подпапок). Миниатюры уже
+    обработанных и не изменённых файлов не пересоздаются, миниатюры удалённых файлов
+    удаляются. Если изображений нет, файл хранилища не создаётся
+    :param dataset_dir: Папка датасета
+    :param classes: Классы изображений
+    :param size: Максимальная сторона миниатюры
+    :param workers: Количество потоков
+    :param progress: Функция, вызываемая с числом обработанных файлов и общим числом файлов
+    :return: Количество созданных миниатюр
+    """
+    data_dirs = [dataset_dir] + [os.path.join(dataset_dir, class_name) for class_name in classes
+                                 if os.path.isdir(os.path.join(dataset_dir, class_name))]
+    files = {abs_path: entry.stat().st_mtime_ns
+             for _, abs_path, _, entry in scan_dirs(data_dirs)
+             if entry.name.lower().endswith(IMAGE_EXTENSIONS)}
+    store_path = os.path.join(dataset_dir, THUMBNAILS_FILE)
+    if not files and not os.path.exists(store_path):
+        return 0
+    with ThumbnailStore(store_path) as store:
+        stamps = store.stamps()
+        jobs = [(path, mtime) for path, mtime in files.items() if stamps.get(path) != mtime]
+        store.remove([path for path in stamps if path not in files])
+
+        created = 0
+        chunk_size = workers * 16
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for start in range(0, len(jobs), chunk_size):
+                chunk = jobs[start:start + chunk_size]
+                rows = [row for row in executor.map(make_row, chunk, [size] * len(chunk))
+                        if row is not None]
+                store.add(rows)
+                created += len(rows)
+                if progress is not None:
+                    progress(start + len(chunk), len(jobs))
+        return created
+
+
+if __name__ == "__main__":
+    app = QGuiApplication(sys.argv)
+    print(build_thumbnails("dataset", ["cat", "dog"]))
@@ -0,0 +1,59 @@
+import threading
+import traceback
+from collections.abc import Callable
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class WorkerCancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    def __init__(self, function: Callable, *args, **kwargs):
+        """
+        Инициализация задачи для QThreadPool
+        :param function: Функция, принимающая именованный параметр progress
+        :param args: Позиционные параметры функции
+        :param kwargs: Именованные параметры функции
+        """
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        Запрос отмены, задача прерывается при следующем сообщении о прогрессе
+        """
+        self.cancel_event.set()
+
+    def report(self, done: int, total: int | None):
+        """
+        Передача прогресса в поток интерфейса
+        :param done: Количество обработанных файлов
+        :param total: Общее количество файлов или None, если оно неизвестно
+        :return:
+        """
+        if self.cancel_event.is_set():
+            raise WorkerCancelled()
+        self.signals.progress.emit(done, -1 if total is None else total)
+
+    def run(self):
+        try:
+            result = self.function(*self.args, progress=self.report, **self.kwargs)
+        except WorkerCancelled:
+            self.signals.cancelled.emit()
+        except Exception:
+            self.signals.failed.emit(traceback.format_exc(limit=1))
+        else:
+            self.signals.finished.emit(result)
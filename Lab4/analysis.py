@@ -4,13 +4,20 @@ import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 
+from columnar import ColumnarAnnotation, is_columnar
+from iterator import BatchIterator
+
 
 def get_dataframe(path: str) -> pd.DataFrame:
     """
     Получение датафрейма
-    :param path: Путь к аннотации
+    :param path: Путь к аннотации (TSV или колоночной)
     :return:
     """
+    if is_columnar(path):
+        annotation = ColumnarAnnotation(path)
+        names = np.asarray(annotation.classes)[annotation.class_ids()].astype(object)
+        return pd.DataFrame({'AbsPath': annotation.abs_paths(), 'Name': names})
     return pd.read_csv(path, delimiter='\t', usecols=(0, 2), names=('AbsPath', 'Name'))
 
 
@@ -29,12 +36,21 @@ def add_size_col(df: pd.DataFrame) -> pd.DataFrame:
     Добавление колонок с высотой, шириной и грубиной изображений
     """
     new_df = df.copy()
-    new_df["Height"] = new_df["AbsPath"].apply(lambda path: plt.imread(path).shape[0])
-    new_df["Width"] = new_df["AbsPath"].apply(lambda path: plt.imread(path).shape[1])
-    new_df["Channels"] = new_df["AbsPath"].apply(lambda path: plt.imread(path).shape[2])
+    shapes = [shape for batch in BatchIterator(new_df["AbsPath"], loader=get_shape)
+              for shape in batch]
+    new_df["Height"] = [shape[0] for shape in shapes]
+    new_df["Width"] = [shape[1] for shape in shapes]
+    new_df["Channels"] = [shape[2] for shape in shapes]
     return new_df
 
 
+def get_shape(path: str) -> tuple[int, ...]:
+    """
+    Размеры изображения
+    """
+    return plt.imread(path).shape
+
+
 def statistic(df: pd.DataFrame):
     """
     Получение статистики
@@ -1,48 +1,58 @@
 import os
-import csv
-import shutil
+from collections.abc import Callable
 
-from annotation import get_paths, get_abs_paths
+from annotation import scan_dir, scan_dirs, write_annotation
+from file_copy import COPY_WORKERS, FileCopier, copy_files
+from labels import LabelResolver
 
 
-def create_dataset_copy(old_path: str, new_path: str, classes: list[str]):
+def create_dataset_copy(old_path: str, new_path: str, classes: list[str],
+                        copier: FileCopier = None, workers: int = COPY_WORKERS,
+                        progress: Callable[[int, int | None], None] = None,
+                        verify: bool = False) -> int:
     """
     Создание копии датасета
     :param old_path: Путь к старому датасеты
     :param new_path: Путь к новому датасету
     :param classes: Классы изображений
-    :return:
+    :param copier: Способ копирования файлов, по умолчанию выбирается автоматически
+    :param workers: Количество потоков копирования
+    :param progress: Функция, вызываемая с числом скопированных файлов и общим числом файлов
+    :param verify: Сверять контрольные суммы копий
+    :return: Количество скопированных файлов
     """
     if not os.path.exists(new_path):
         os.makedirs(new_path)
-    for class_name in classes:
-        class_path = os.path.join(old_path, class_name)
-        images = os.listdir(os.path.join(old_path, class_name))
-        for image in images:
-            shutil.copyfile(os.path.join(class_path, image),
-                            os.path.join(new_path, f"{class_name}_{image}"))
+    class_dirs = [os.path.join(old_path, class_name) for class_name in classes]
+    pairs = ((path, os.path.join(new_path, f"{classes[index]}_{entry.name}"))
+             for index, _, path, entry in scan_dirs(class_dirs))
+    return copy_files(pairs, copier, workers, progress, verify)
 
 
-def create_copy_annotation(dataset_dir: str, classes: list[str], save_path: str):
+def create_copy_annotation(dataset_dir: str, classes: list[str], save_path: str,
+                           incremental: bool = False,
+                           progress: Callable[[int, int | None], None] = None) -> bool:
     """
     Создание аннотации для датасета
     :param dataset_dir: Папка датасета
     :param classes: Классы изображений
     :param save_path: Путь к аннотации
-    :return:
+    :param incremental: Обновлять существующую аннотацию вместо полного пересоздания
+    :param progress: Функция, вызываемая с числом обработанных файлов и общим числом файлов
+    :return: True, если аннотация была изменена
     """
-    if os.path.exists(save_path):
-        os.remove(save_path)
-    paths = get_paths(dataset_dir)
-    abs_paths = get_abs_paths(dataset_dir)
-    for class_name in classes:
-        with open(save_path, 'a') as csv_file:
-            writer = csv.writer(csv_file, delimiter='\t', lineterminator='\n')
-            for path, abs_path in zip(paths, abs_paths):
-                if class_name in path:
-                    writer.writerow([abs_path, path, class_name])
+    resolver = LabelResolver(classes)
+    buckets = {class_name: [] for class_name in classes}
+    for abs_path, path, entry in scan_dir(dataset_dir):
+        class_name = resolver.resolve(path)
+        if class_name:
+            buckets[class_name].append((abs_path, path, class_name, entry))
+    rows = (row for class_name in classes for row in buckets[class_name])
+    return write_annotation(rows, save_path, incremental, progress)
 
 
 if __name__ == "__main__":
-    create_dataset_copy("dataset", "dataset_copy", ["cat", "dog"])
+    dataset_copier = FileCopier()
+    create_dataset_copy("dataset", "dataset_copy", ["cat", "dog"], dataset_copier)
+    print(dataset_copier)
     create_copy_annotation("dataset_copy", ["cat", "dog"], "annotation_copy.csv")
@@ -0,0 +1,244 @@
+import asyncio
+import bisect
+import random
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import aiohttp
+
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 30.0
+ATTEMPTS = 4
+BASE_DELAY = 0.5
+MAX_DELAY = 30.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+class RetryableStatusError(aiohttp.ClientError):
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url}: HTTP {status}")
+        self.status = status
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    def __init__(self, host: str):
+        super().__init__(f"Circuit breaker is open for {host}")
+        self.host = host
+
+
+class HostRateLimiter:
+    def __init__(self, rate: float):
+        """
+        Инициализация
+        :param rate: Максимальное количество запросов в секунду к одному хосту
+        """
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_time = {}
+        self.lock = asyncio.Lock()
+
+    async def wait(self, url: str):
+        """
+        Ожидание очереди на запрос к хосту
+        :param url: Адрес запроса
+        :return:
+        """
+        host = urlsplit(url).netloc
+        async with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time.get(host, now))
+            self.next_time[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        """
+        Инициализация
+        :param threshold: Количество ошибок подряд, после которого запросы к хосту блокируются
+        :param reset_timeout: Время блокировки до пробного запроса в секундах
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        """
+        Проверка, можно ли выполнить запрос. После истечения блокировки пропускается
+        один пробный запрос, и блокировка взводится заново до его результата
+        """
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: list[float] = None):
+        """
+        Инициализация
+        :param buckets: Верхние границы корзин в секундах
+        """
+        self.buckets = buckets or LATENCY_BUCKETS
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+
+    def record(self, seconds: float):
+        """
+        Учёт длительности запроса
+        :param seconds: Длительность в секундах
+        :return:
+        """
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.total += seconds
+
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, q: float) -> float:
+        """
+        Оценка перцентиля по верхней границе корзины
+        :param q: Перцентиль от 0 до 100
+        :return: Длительность в секундах
+        """
+        target = self.count() * q / 100
+        passed = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            passed += count
+            if count and passed >= target:
+                return bound
+        return 0.0
+
+    def __str__(self):
+        count = self.count()
+        mean = self.total / count if count else 0.0
+        return (f"n={count} mean={mean * 1000:.0f}ms p50<={self.percentile(50)}s "
+                f"p95<={self.percentile(95)}s p99<={self.percentile(99)}s")
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Разбор заголовка Retry-After
+    :param value: Количество секунд или HTTP-дата
+    :return: Задержка в секундах или None
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt: int, retry_after: float = None, base_delay: float = BASE_DELAY,
+                  max_delay: float = MAX_DELAY) -> float:
+    """
+    Экспоненциальная задержка со случайным разбросом
+    :param attempt: Номер неудачной попытки, начиная с нуля
+    :param retry_after: Задержка, запрошенная сервером, соблюдается полностью
+    :param base_delay: Базовая задержка в секундах
+    :param max_delay: Максимальная задержка в секундах
+    :return: Задержка в секундах
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def create_timeout(connect: float = CONNECT_TIMEOUT,
+                   read: float = READ_TIMEOUT) -> aiohttp.ClientTimeout:
+    """
+    Таймауты соединения и чтения
+    :param connect: Таймаут установки соединения в секундах
+    :param read: Таймаут между порциями данных в секундах
+    :return: Настройки таймаутов для сессии
+    """
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+
+class Fetcher:
+    def __init__(self, session: aiohttp.ClientSession, concurrency: int, rate: float,
+                 headers: dict[str, str] = None, attempts: int = ATTEMPTS):
+        """
+        Инициализация
+        :param session: Сессия с общим пулом соединений
+        :param concurrency: Максимальное количество одновременных запросов
+        :param rate: Максимальное количество запросов в секунду к одному хосту
+        :param headers: Заголовки запросов
+        :param attempts: Максимальное количество попыток
+        """
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = HostRateLimiter(rate)
+        self.headers = headers
+        self.attempts = attempts
+        self.breakers = {}
+        self.latency = {}
+
+    async def fetch(self, url: str, handler: Callable[[aiohttp.ClientResponse], Awaitable]):
+        """
+        Запрос с повторами: при сетевых ошибках, таймаутах и ответах 429/5xx запрос
+        повторяется с экспоненциальной задержкой, остальные ошибки HTTP не повторяются.
+        Если сервер просит подождать дольше MAX_DELAY, запрос сразу завершается ошибкой
+        :param url: Адрес запроса
+        :param handler: Обработчик успешного ответа, повторяется вместе с запросом
+        :return: Результат обработчика
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breakers.setdefault(host, CircuitBreaker())
+        latency = self.latency.setdefault(host, LatencyHistogram())
+        error = None
+        for attempt in range(self.attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(host)
+            retry_after = None
+            await self.limiter.wait(url)
+            async with self.semaphore:
+                start = time.monotonic()
+                try:
+                    async with self.session.get(url, headers=self.headers) as response:
+                        if response.status in RETRY_STATUSES:
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            raise RetryableStatusError(url, response.status)
+                        response.raise_for_status()
+                        result = await handler(response)
+                except aiohttp.ClientResponseError:
+                    breaker.record_success()
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                    error = exc
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                    return result
+                finally:
+                    latency.record(time.monotonic() - start)
+            if retry_after is not None and retry_after > MAX_DELAY:
+                break
+            if attempt + 1 < self.attempts:
+                await asyncio.sleep(backoff_delay(attempt, retry_after))
+        raise error
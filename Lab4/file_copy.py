@@ -0,0 +1,210 @@
+import os
+import errno
+import shutil
+import hashlib
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+AUTO_ORDER = ('hardlink', 'reflink', 'copy')
+STRATEGIES = ('auto', 'hardlink', 'reflink', 'symlink', 'copy')
+COPY_WORKERS = 8
+UNSUPPORTED_ERRORS = {
+    'hardlink': {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP},
+    'reflink': {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                errno.ENOSYS},
+}
+CHUNK_SIZE = 1024 * 1024
+
+
+def hardlink(src: str, dst: str) -> int:
+    os.link(src, dst)
+    return 0
+
+
+def symlink(src: str, dst: str) -> int:
+    os.symlink(os.path.abspath(src), dst)
+    return 0
+
+
+def reflink(src: str, dst: str) -> int:
+    """
+    Копирование через общие блоки файловой системы (btrfs, XFS), данные не записываются
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform")
+    with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+    return 0
+
+
+def copy(src: str, dst: str) -> int:
+    """
+    Копирование данных в ядре через copy_file_range, при его отсутствии через shutil,
+    который сам использует sendfile там, где он доступен
+    """
+    size = os.path.getsize(src)
+    if hasattr(os, 'copy_file_range'):
+        try:
+            with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                copied = 0
+                while copied < size:
+                    count = os.copy_file_range(src_file.fileno(), dst_file.fileno(), size - copied)
+                    if count == 0:
+                        break
+                    copied += count
+            if copied == size:
+                return size
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return size
+
+
+COPY_FUNCTIONS = {'hardlink': hardlink, 'reflink': reflink, 'symlink': symlink, 'copy': copy}
+
+
+class FileCopier:
+    def __init__(self, strategy: str = 'auto'):
+        """
+        Инициализация
+        :param strategy: Способ копирования: auto, hardlink, reflink, symlink или copy.
+        auto выбирает самый дешёвый из доступных способов: жёсткую ссылку,
+        reflink, копирование в ядре
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown copy strategy: {strategy}")
+        self.strategy = strategy
+        self.unsupported = set()
+        self.bytes_written = 0
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def copy(self, src: str, dst: str) -> str:
+        """
+        Копирование файла
+        :param src: Путь к исходному файлу
+        :param dst: Путь к копии
+        :return: Использованный способ копирования
+        """
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if self.strategy != 'auto':
+            self.record(self.strategy, COPY_FUNCTIONS[self.strategy](src, dst))
+            return self.strategy
+        for strategy in AUTO_ORDER:
+            if strategy in self.unsupported:
+                continue
+            try:
+                written = COPY_FUNCTIONS[strategy](src, dst)
+            except OSError as exc:
+                if exc.errno not in UNSUPPORTED_ERRORS.get(strategy, ()):
+                    raise
+                with self.lock:
+                    self.unsupported.add(strategy)
+                continue
+            self.record(strategy, written)
+            return strategy
+        raise OSError(f"Cannot copy {src}")
+
+    def record(self, strategy: str, written: int):
+        with self.lock:
+            self.bytes_written += written
+            self.counts[strategy] = self.counts.get(strategy, 0) + 1
+
+    def __str__(self):
+        counts = ", ".join(f"{strategy}: {count}" for strategy, count in self.counts.items())
+        return f"{counts}; bytes written: {self.bytes_written}"
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 содержимого файла
+    :param path: Путь к файлу
+    :return: Хэш
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_verified(copier: FileCopier, src: str, dst: str, verify: bool):
+    """
+    Копирование файла с необязательной проверкой контрольной суммы
+    :param copier: Способ копирования
+    :param src: Путь к исходному файлу
+    :param dst: Путь к копии
+    :param verify: Сверять SHA-256 копии с исходным файлом
+    :return:
+    """
+    copier.copy(src, dst)
+    if verify and file_digest(src) != file_digest(dst):
+        raise ValueError(f"Checksum mismatch: {src} -> {dst}")
+
+
+def copy_files(pairs: Iterable[tuple[str, str]], copier: FileCopier = None,
+               workers: int = COPY_WORKERS, progress: Callable[[int, int | None], None] = None,
+               verify: bool = False, total: int = None) -> int:
+    """
+    Параллельное копирование файлов пулом потоков. Пары читаются потоком,
+    одновременно в работе не больше нескольких задач на поток
+    :param pairs: Пары (исходный файл, копия)
+    :param copier: Способ копирования, по умолчанию выбирается автоматически
+    :param workers: Количество потоков
+    :param progress: Функция, вызываемая с числом скопированных файлов и общим числом файлов,
+    если оно уже известно
+    :param verify: Сверять SHA-256 каждой копии с исходным файлом
+    :param total: Общее количество файлов, если известно заранее
+    :return: Количество скопированных файлов
+    """
+    if copier is None:
+        copier = FileCopier()
+    done = 0
+    submitted = 0
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for src, dst in pairs:
+                if len(pending) >= workers * 4:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    done += report(finished, progress, done, total)
+                pending.add(executor.submit(copy_verified, copier, src, dst, verify))
+                submitted += 1
+            total = submitted
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += report(finished, progress, done, total)
+        finally:
+            for future in pending:
+                future.cancel()
+    return done
+
+
+def report(finished: set, progress: Callable[[int, int | None], None], done: int,
+           total: int | None) -> int:
+    """
+    Проверка завершённых задач и вызов функции прогресса
+    :param finished: Завершённые задачи
+    :param progress: Функция прогресса
+    :param done: Количество ранее скопированных файлов
+    :param total: Общее количество файлов или None
+    :return: Количество файлов, скопированных в этих задачах
+    """
+    for future in finished:
+        future.result()
+    if progress is not None:
+        progress(done + len(finished), total)
+    return len(finished)
@@ -0,0 +1,30 @@
+import os
+
+
+class LabelResolver:
+    def __init__(self, classes: list[str]):
+        """
+        Инициализация словаря классов
+        :param classes: Классы изображений
+        """
+        self.classes = set(classes)
+
+    def resolve(self, path: str) -> str:
+        """
+        Определение класса изображения по имени вида {класс}_{имя} или по имени папки.
+        Проверяются только префиксы имени до символов '_', поэтому время не зависит
+        от количества классов; при нескольких подходящих префиксах выбирается самый длинный
+        :param path: Путь к изображению
+        :return: Класс изображения или пустая строка
+        """
+        name = os.path.basename(path)
+        found = ""
+        position = name.find('_')
+        while position != -1:
+            if name[:position] in self.classes:
+                found = name[:position]
+            position = name.find('_', position + 1)
+        if found:
+            return found
+        parent = os.path.basename(os.path.dirname(path))
+        return parent if parent in self.classes else ""
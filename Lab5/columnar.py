@@ -0,0 +1,127 @@
+import os
+import csv
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+
+ROW_DTYPE = np.dtype([('abs_start', '<i8'), ('abs_end', '<i8'),
+                      ('path_start', '<i8'), ('path_end', '<i8'), ('class_id', '<i4')])
+ROWS_FILE = 'rows.npy'
+STRINGS_FILE = 'strings.npy'
+CLASSES_FILE = 'classes.npy'
+
+
+def is_columnar(path: str) -> bool:
+    """
+    Проверка, является ли аннотация колоночной
+    :param path: Путь к аннотации
+    :return: True, если это папка колоночной аннотации
+    """
+    return os.path.isfile(os.path.join(path, ROWS_FILE))
+
+
+def write_columnar(rows: Iterable[Iterable[str]], save_path: str):
+    """
+    Запись колоночной аннотации: таблица смещений строк, общий буфер строк UTF-8
+    и таблица классов, на которую строки ссылаются по номеру
+    :param rows: Строки (абсолютный путь, относительный путь, класс)
+    :param save_path: Путь к папке аннотации
+    :return:
+    """
+    strings = bytearray()
+    offsets = []
+    class_ids = {}
+    for abs_path, path, class_name in rows:
+        abs_start = len(strings)
+        strings += abs_path.encode()
+        path_start = len(strings)
+        strings += path.encode()
+        class_id = class_ids.setdefault(class_name, len(class_ids))
+        offsets.append((abs_start, path_start, path_start, len(strings), class_id))
+    table = np.array(offsets, dtype=ROW_DTYPE)
+    os.makedirs(save_path, exist_ok=True)
+    np.save(os.path.join(save_path, STRINGS_FILE), np.frombuffer(bytes(strings), dtype=np.uint8))
+    np.save(os.path.join(save_path, CLASSES_FILE), np.array(list(class_ids), dtype=str))
+    np.save(os.path.join(save_path, ROWS_FILE), table)
+
+
+def tsv_to_columnar(tsv_path: str, save_path: str):
+    """
+    Преобразование аннотации TSV в колоночную
+    :param tsv_path: Путь к аннотации TSV
+    :param save_path: Путь к папке колоночной аннотации
+    :return:
+    """
+    with open(tsv_path, 'r', newline='', encoding='utf-8') as csv_file:
+        write_columnar(csv.reader(csv_file, delimiter='\t'), save_path)
+
+
+def columnar_to_tsv(path: str, tsv_path: str):
+    """
+    Преобразование колоночной аннотации в TSV
+    :param path: Путь к папке колоночной аннотации
+    :param tsv_path: Путь к аннотации TSV
+    :return:
+    """
+    annotation = ColumnarAnnotation(path)
+    with open(tsv_path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file, delimiter='\t', lineterminator='\n')
+        writer.writerows(annotation)
+
+
+class ColumnarAnnotation:
+    def __init__(self, path: str, mmap: bool = True):
+        """
+        Открытие колоночной аннотации
+        :param path: Путь к папке аннотации
+        :param mmap: Отображать таблицы в память вместо чтения целиком
+        """
+        mode = 'r' if mmap else None
+        self.rows = np.load(os.path.join(path, ROWS_FILE), mmap_mode=mode)
+        self.strings = np.load(os.path.join(path, STRINGS_FILE), mmap_mode=mode)
+        self.classes = [str(name) for name in np.load(os.path.join(path, CLASSES_FILE))]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index: int) -> tuple[str, str, str]:
+        row = self.rows[index]
+        return (self.get_string(row['abs_start'], row['abs_end']),
+                self.get_string(row['path_start'], row['path_end']),
+                self.classes[row['class_id']])
+
+    def __iter__(self) -> Iterator[tuple[str, str, str]]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def get_string(self, start: int, end: int) -> str:
+        return self.strings[start:end].tobytes().decode()
+
+    def class_ids(self) -> np.ndarray:
+        """
+        Номера классов всех строк
+        """
+        return self.rows['class_id']
+
+    def class_indices(self, class_name: str) -> np.ndarray:
+        """
+        Номера строк класса
+        :param class_name: Класс изображения
+        :return: Массив номеров строк
+        """
+        if class_name not in self.classes:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(self.rows['class_id'] == self.classes.index(class_name))
+
+    def abs_paths(self) -> list[str]:
+        """
+        Абсолютные пути всех строк
+        """
+        data = self.strings.tobytes()
+        return [data[start:end].decode()
+                for start, end in zip(self.rows['abs_start'].tolist(), self.rows['abs_end'].tolist())]
+
+
+if __name__ == "__main__":
+    tsv_to_columnar("annotation.csv", "annotation")
+    print(len(ColumnarAnnotation("annotation")))
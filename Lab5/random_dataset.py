@@ -1,9 +1,16 @@
 import os
-import shutil
 import csv
+import json
 import random
+from collections.abc import Callable, Iterator
 
-from annotation import get_paths, get_abs_paths
+from annotation import replace_file, scan_dir, write_annotation
+from columnar import ColumnarAnnotation, is_columnar
+from file_copy import COPY_WORKERS, FileCopier, copy_files
+from labels import LabelResolver
+
+VIEW_SUFFIX = '.view'
+FEISTEL_ROUNDS = 4
 
 
 def get_class(path: str, classes: list[str]) -> str:
@@ -13,53 +20,171 @@ def get_class(path: str, classes: list[str]) -> str:
     :param classes: Классы изображений
     :return: Класс изображения
     """
-    for class_name in classes:
-        if class_name in path:
-            return class_name
-    return ""
+    return LabelResolver(classes).resolve(path)
+
+
+class FeistelPermutation:
+    def __init__(self, size: int, seed: int = None, rounds: int = FEISTEL_ROUNDS):
+        """
+        Псевдослучайная перестановка чисел от 0 до size - 1 без хранения таблицы:
+        сеть Фейстеля над ближайшей степенью двойки и повторное шифрование
+        значений, выходящих за диапазон
+        :param size: Размер диапазона
+        :param seed: Зерно перестановки, по умолчанию выбирается случайно
+        :param rounds: Количество раундов сети
+        """
+        bits = max(2, (size - 1).bit_length())
+        bits += bits % 2
+        self.size = size
+        self.half = bits // 2
+        self.mask = (1 << self.half) - 1
+        generator = random.Random(seed)
+        self.keys = [generator.getrandbits(64) for _ in range(rounds)]
+
+    def round_function(self, value: int, key: int) -> int:
+        value = ((value ^ key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        value ^= value >> 31
+        value = (value * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        value ^= value >> 29
+        return value & self.mask
+
+    def encrypt(self, value: int) -> int:
+        left, right = value >> self.half, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self.round_function(right, key)
+        return (left << self.half) | right
+
+    def __getitem__(self, index: int) -> int:
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        value = self.encrypt(index)
+        while value >= self.size:
+            value = self.encrypt(value)
+        return value
+
+    def __len__(self):
+        return self.size
 
 
-def create_dataset_random(old_path: str, new_path: str,
-                          classes: list[str]) -> dict[str, str]:
+def create_dataset_random(old_path: str, new_path: str, classes: list[str],
+                          copier: FileCopier = None, workers: int = COPY_WORKERS,
+                          progress: Callable[[int, int | None], None] = None,
+                          verify: bool = False, seed: int = None) -> dict[str, str]:
     """
-    Создание перемешанного датасета
+    Создание перемешанного датасета. Каждое изображение получает уникальный номер
+    из диапазона от 0 до размера датасета. Файлы без класса (аннотация и служебные
+    файлы рядом с ней) не копируются
     :param old_path: Путь к старому датасету
     :param new_path: Путь к новому датасету
     :param classes: Классы изображений
+    :param copier: Способ копирования файлов, по умолчанию выбирается автоматически
+    :param workers: Количество потоков копирования
+    :param progress: Функция, вызываемая с числом скопированных файлов и общим числом файлов
+    :param verify: Сверять контрольные суммы копий
+    :param seed: Зерно перестановки имён, по умолчанию выбирается случайно
     :return: Список путей к изображениям и их классов
     """
-    new_names = [f'{num}.jpg' for num in random.sample(range(10001), 2000)]
     if not os.path.exists(new_path):
         os.makedirs(new_path)
 
-    paths = get_paths(old_path)
+    resolver = LabelResolver(classes)
+
+    def get_labelled() -> Iterator[tuple[str, str]]:
+        for _, old_name, _ in scan_dir(old_path):
+            class_name = resolver.resolve(old_name)
+            if class_name:
+                yield old_name, class_name
+
+    size = sum(1 for _ in get_labelled())
+    permutation = FeistelPermutation(size, seed)
     classes_dict = {}
-    for new_name, old_name in zip(new_names, paths):
-        shutil.copyfile(old_name, os.path.join(new_path, new_name))
-        classes_dict[new_name] = get_class(old_name, classes)
+
+    def get_pairs() -> Iterator[tuple[str, str]]:
+        for index, (old_name, class_name) in zip(range(size), get_labelled()):
+            new_name = f'{permutation[index]}.jpg'
+            classes_dict[new_name] = class_name
+            yield old_name, os.path.join(new_path, new_name)
+
+    copy_files(get_pairs(), copier, workers, progress, verify, size)
     return classes_dict
 
 
-def create_random_annotation(dataset_dir: str, classes_dict: dict[str, str], save_path: str):
+def create_random_annotation(dataset_dir: str, classes_dict: dict[str, str], save_path: str,
+                             incremental: bool = False,
+                             progress: Callable[[int, int | None], None] = None) -> bool:
     """
     Создание аннотации к перемешанному датасету
     :param dataset_dir: Папка датасета
     :param classes_dict: Список путей к изображениям и их классов
     :param save_path: Путь к аннотации
-    :return:
+    :param incremental: Обновлять существующую аннотацию вместо полного пересоздания
+    :param progress: Функция, вызываемая с числом обработанных файлов и общим числом файлов
+    :return: True, если аннотация была изменена
+    """
+    rows = ((abs_path, path, classes_dict[entry.name], entry)
+            for abs_path, path, entry in scan_dir(dataset_dir)
+            if entry.name in classes_dict)
+    return write_annotation(rows, save_path, incremental, progress)
+
+
+def read_rows(annotation: str) -> list[tuple[str, str, str]]:
+    """
+    Чтение строк аннотации
+    :param annotation: Путь к аннотации (TSV или колоночной)
+    :return: Список строк (абсолютный путь, относительный путь, класс)
+    """
+    if is_columnar(annotation):
+        return list(ColumnarAnnotation(annotation))
+    with open(annotation, 'r', newline='', encoding='utf-8') as csv_file:
+        return [tuple(row) for row in csv.reader(csv_file, delimiter='\t')]
+
+
+def get_view_path(save_path: str) -> str:
+    """
+    Путь к описанию виртуального датасета
+    :param save_path: Путь к аннотации виртуального датасета
+    :return: Путь к файлу описания
+    """
+    return save_path + VIEW_SUFFIX
+
+
+def create_random_view(annotation: str, save_path: str, seed: int = None) -> int:
+    """
+    Создание перемешанного датасета без копирования изображений: аннотация содержит
+    строки исходной аннотации в перемешанном порядке и ссылается на исходные файлы,
+    поэтому читается итератором и анализом как обычная. Источник и зерно
+    перестановки сохраняются рядом, перестановку можно воспроизвести
+    :param annotation: Путь к исходной аннотации
+    :param save_path: Путь к аннотации виртуального датасета
+    :param seed: Зерно перестановки, по умолчанию выбирается случайно
+    :return: Зерно перестановки
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    rows = read_rows(annotation)
+    random.Random(seed).shuffle(rows)
+    replace_file(save_path, rows)
+    with open(get_view_path(save_path), 'w', encoding='utf-8') as view_file:
+        json.dump({"source": os.path.abspath(annotation), "seed": seed, "rows": len(rows)},
+                  view_file)
+    return seed
+
+
+def rebuild_random_view(save_path: str) -> int:
+    """
+    Повторное построение виртуального датасета по сохранённому описанию
+    :param save_path: Путь к аннотации виртуального датасета
+    :return: Зерно перестановки
     """
-    if os.path.exists(save_path):
-        os.remove(save_path)
-    paths = get_paths(dataset_dir)
-    abs_paths = get_abs_paths(dataset_dir)
-    names = os.listdir(dataset_dir)
-    with open(save_path, 'a') as csv_file:
-        writer = csv.writer(csv_file, delimiter='\t', lineterminator='\n')
-        for name, path, abs_path in zip(names, paths, abs_paths):
-            writer.writerow([abs_path, path, classes_dict[name]])
+    with open(get_view_path(save_path), 'r', encoding='utf-8') as view_file:
+        view = json.load(view_file)
+    return create_random_view(view["source"], save_path, view["seed"])
 
 
 if __name__ == "__main__":
-    cls_dict = create_dataset_random("dataset_copy", "dataset_random", ["cat", "dog"])
+    random_copier = FileCopier()
+    cls_dict = create_dataset_random("dataset_copy", "dataset_random", ["cat", "dog"],
+                                     random_copier)
+    print(random_copier)
     create_random_annotation("dataset_random", cls_dict, "annotation_random.csv")
 